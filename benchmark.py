@@ -0,0 +1,333 @@
+"""Headless benchmarks for the viewer's document loading and rendering paths.
+
+Generates synthetic PDFs and CBZs, then times opening, rendering, page turns and zooming
+through the same page sources the viewer uses, without creating any Tk windows.
+
+    python benchmark.py                          # full run, prints a summary
+    python benchmark.py --quick -o new.json      # smaller documents, save results
+    python benchmark.py -o new.json --compare old.json
+
+With --compare the exit code is 1 when any scenario got slower than --threshold.
+"""
+import os
+import sys
+import io
+import json
+import time
+import zipfile
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+import subprocess
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not available on Windows
+
+import fitz
+from PIL import Image
+
+import viewer
+
+# name -> (kind, keyword arguments for the generator)
+CASES = {
+    'pdf-vector': ('pdf', {'pages': 200, 'images': False}),
+    'pdf-scanned': ('pdf', {'pages': 60, 'images': True, 'size': (2480, 3508)}),
+    'cbz-jpeg-small': ('cbz', {'pages': 200, 'size': (1200, 1800), 'format': 'JPEG'}),
+    'cbz-jpeg-large': ('cbz', {'pages': 60, 'size': (4000, 6000), 'format': 'JPEG'}),
+    'cbz-png': ('cbz', {'pages': 60, 'size': (1600, 2400), 'format': 'PNG'}),
+}
+QUICK_PAGES = 12  # Page count used by --quick
+ZOOM_LEVELS = (0.5, 1.0, 2.0, 4.0)  # Multiples of the fit-height zoom
+HANDOFF_ZOOMS = (1, 2, 4)  # Absolute zoom levels, 72 dpi times these, for the render to Tk handoff
+STALL_ZOOM = 3  # Absolute zoom of the PDF renders the main thread stall is measured during
+STALL_TICK = 0.001  # Sleep between main thread checks while measuring stalls
+
+
+def synthetic_image(size, seed):
+    # Gradient plus noise, so JPEG and PNG have realistic work to do
+    gradient = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, 40 + seed % 20)
+    return Image.merge('RGB', (gradient, noise, gradient.transpose(Image.FLIP_TOP_BOTTOM)))
+
+
+def make_pdf(path, pages, images, size=(595, 842)):
+    document = fitz.open()
+    for index in range(pages):
+        if images:
+            # A scanned page, one full-page raster image
+            buffer = io.BytesIO()
+            synthetic_image(size, index).save(buffer, 'JPEG', quality=85)
+            page = document.new_page(width=595, height=842)
+            page.insert_image(page.rect, stream=buffer.getvalue())
+        else:
+            page = document.new_page(width=595, height=842)
+            for line in range(60):
+                page.insert_text((40, 40 + line * 13), f"Page {index + 1} line {line} " + "lorem ipsum dolor sit amet " * 3, fontsize=9)
+            for shape in range(40):
+                rect = fitz.Rect(40 + shape * 12, 500, 80 + shape * 12, 540 + shape * 6)
+                page.draw_rect(rect, color=(shape / 40, 0.2, 0.5), fill=(0.9, 0.9 - shape / 80, 0.8))
+    document.save(path)
+    document.close()
+
+
+def make_cbz(path, pages, size, format):
+    extension = '.jpg' if format == 'JPEG' else '.png'
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+        for index in range(pages):
+            buffer = io.BytesIO()
+            synthetic_image(size, index).save(buffer, format, **({'quality': 90} if format == 'JPEG' else {}))
+            archive.writestr(f"page{index:04}{extension}", buffer.getvalue())
+
+
+def generate(case, directory, quick):
+    kind, options = CASES[case]
+    options = dict(options)
+    if quick:
+        options['pages'] = min(options['pages'], QUICK_PAGES)
+    path = os.path.join(directory, f"{case}-{options['pages']}.{kind}")
+    if not os.path.exists(path):
+        if kind == 'pdf':
+            make_pdf(path, **options)
+        else:
+            make_cbz(path, **options)
+    return kind, path, options
+
+
+def open_source(kind, path):
+    return viewer.PDFPageSource(path) if kind == 'pdf' else viewer.CBZPageSource(path)
+
+
+def timed(samples, name, func):
+    start = time.perf_counter()
+    result = func()
+    samples.setdefault(name, []).append(time.perf_counter() - start)
+    return result
+
+
+def handoff(source, page, zoom):
+    # A render plus the copy ImageTk.PhotoImage makes of any image that isn't one contiguous block,
+    # everything up to the point Tk copies the pixels into its photo image
+    img = source.render(page, zoom)
+    if not img.im.isblock():
+        block = Image.core.new_block(img.mode, img.size)
+        img.im.convert2(block, img.im)
+        return img, True
+    return img, False
+
+
+def handoff_allocated_mb(source, page, zoom):
+    # Bytes objects show up in tracemalloc, Pillow's image memory and shared memory don't and are added from
+    # the image size: the image, its block copy if it isn't one, and the shared memory it came through from a render process
+    tracemalloc.start()
+    img, copied = handoff(source, page, zoom)
+    python_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    frames = 1 + copied + (source.render_processes is not None)
+    return round((python_peak + viewer.image_nbytes(img) * frames) / 2 ** 20, 2)
+
+
+def render_stall(source, page, zoom):
+    # Longest time the main thread couldn't run while a worker thread rendered, which is how long
+    # the viewer's Tk thread would freeze for. MuPDF holds the GIL while rasterizing in-process
+    worker = threading.Thread(target=source.render, args=(page, zoom))
+    longest = 0.0
+    last = time.perf_counter()
+    worker.start()
+    while worker.is_alive():
+        time.sleep(STALL_TICK)
+        now = time.perf_counter()
+        longest = max(longest, now - last - STALL_TICK)
+        last = now
+    worker.join()
+    return longest
+
+
+def run_case(case, directory, quick, repeat):
+    kind, path, options = generate(case, directory, quick)
+    samples = {}
+
+    # Open: constructing the source and sizing the first page, as the viewer does before drawing
+    for _ in range(repeat):
+        source = timed(samples, 'open', lambda: open_source(kind, path))
+        timed(samples, 'first_page_size', lambda: source.page_size(0))
+        source.close()
+
+    source = open_source(kind, path)
+    width, height = source.page_size(0)
+    fit_height = 1000 / height  # A page fitted into a typical 1080p canvas
+
+    timed(samples, 'first_render', lambda: source.render(0, 1.0))
+
+    # Page turns, every page once at fit-height zoom, cold
+    for page in range(len(source)):
+        timed(samples, 'page_turn', lambda: source.render(page, fit_height))
+
+    # Previews, cold as well, from a fresh source so no page decoded for the page turns is reused
+    preview_source = open_source(kind, path)
+    for page in range(len(preview_source)):
+        timed(samples, 'preview', lambda: preview_source.render_preview(page, fit_height))
+    preview_source.close()
+
+    # Zoom, the same page at several multiples of fit-height. Levels the viewer would render as tiles are skipped
+    for _ in range(repeat):
+        for level in ZOOM_LEVELS:
+            zoom = fit_height * level
+            if width * height * zoom * zoom <= viewer.TILED_RENDER_PIXELS:
+                timed(samples, f'zoom_{level:g}x', lambda: source.render(1 % len(source), zoom))
+
+    allocations = {}
+    if kind == 'pdf':
+        # The viewer renders PDFs through its render processes once they have started
+        pool = viewer.RenderProcesses()
+        processes = viewer.PDFPageSource(path, render_processes=pool)
+        while not pool.ready:
+            time.sleep(0.01)
+
+        # Render to Tk handoff of a PDF page, latency and the full-frame buffers allocated on the way
+        for zoom in HANDOFF_ZOOMS:
+            name = f'handoff_{zoom}x'
+            for _ in range(repeat):
+                timed(samples, name, lambda: handoff(processes, 0, zoom))
+            allocations[name] = handoff_allocated_mb(processes, 0, zoom)
+
+        # Main thread stall during a render on a worker thread, in-process and through the render processes
+        in_process = samples.setdefault(f'stall_thread_{STALL_ZOOM}x', [])
+        for page in range(min(repeat, len(source))):
+            in_process.append(render_stall(source, page, STALL_ZOOM))
+        in_processes = samples.setdefault(f'stall_process_{STALL_ZOOM}x', [])
+        for page in range(min(repeat, len(processes))):
+            in_processes.append(render_stall(processes, page, STALL_ZOOM))
+        processes.close()
+        pool.close()
+
+    # High zoom tiles, one viewport's worth
+    zoom = fit_height * ZOOM_LEVELS[-1]
+    for row in range(2):
+        for column in range(3):
+            clip = (column * viewer.TILE_SIZE, row * viewer.TILE_SIZE, (column + 1) * viewer.TILE_SIZE, (row + 1) * viewer.TILE_SIZE)
+            timed(samples, 'tile_4x', lambda: source.render(0, zoom, clip))
+    source.close()
+
+    return {
+        'kind': kind,
+        'pages': options['pages'],
+        'page_size': [round(width), round(height)],
+        'file_mb': round(os.path.getsize(path) / 2 ** 20, 2),
+        'peak_rss_mb': peak_rss_mb(),
+        'scenarios': {name: dict(summarize(values), **({'alloc_mb': allocations[name]} if name in allocations else {}))
+                      for name, values in samples.items()},
+    }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 0.5) * 1000, 3),
+        'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+        'mean_ms': round(statistics.fmean(values) * 1000, 3),
+        'throughput_per_s': round(len(values) / sum(values), 2) if sum(values) else None,
+    }
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return round(peak / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)
+
+
+def run_isolated(case, args):
+    # Each case runs in its own interpreter so peak RSS is measured per case
+    command = [sys.executable, os.path.abspath(__file__), '--case', case, '--workdir', args.workdir, '--repeat', str(args.repeat)]
+    if args.quick:
+        command.append('--quick')
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compare(results, baseline, threshold):
+    # Returns the list of regressions between two result files
+    regressions = []
+    for case, result in results['cases'].items():
+        old_case = baseline.get('cases', {}).get(case)
+        if not old_case:
+            continue
+        for name, stats in result['scenarios'].items():
+            old = old_case['scenarios'].get(name)
+            if not old:
+                continue
+            for metric in ('p50_ms', 'p95_ms', 'alloc_mb'):
+                if old.get(metric) and stats.get(metric) and stats[metric] / old[metric] > threshold:
+                    regressions.append(f"{case} {name} {metric}: {old[metric]:.1f} -> {stats[metric]:.1f}")
+        old_rss, rss = old_case.get('peak_rss_mb'), result.get('peak_rss_mb')
+        if old_rss and rss and rss / old_rss > threshold:
+            regressions.append(f"{case} peak_rss_mb: {old_rss:.1f} -> {rss:.1f}")
+    return regressions
+
+
+def print_summary(results):
+    for case, result in results['cases'].items():
+        print(f"{case}  ({result['kind']}, {result['pages']} pages, {result['file_mb']} MB, peak RSS {result['peak_rss_mb']} MB)")
+        for name, stats in result['scenarios'].items():
+            allocated = f"   {stats['alloc_mb']:>7.1f} MB allocated" if 'alloc_mb' in stats else ""
+            print(f"  {name:<16} p50 {stats['p50_ms']:>9.2f} ms   p95 {stats['p95_ms']:>9.2f} ms   {stats['throughput_per_s']:>8} /s{allocated}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark document open and render latency")
+    parser.add_argument('cases', nargs='*', help=f"Cases to run, all by default ({', '.join(CASES)})")
+    parser.add_argument('-o', '--output', help="Write machine-readable results to this JSON file")
+    parser.add_argument('--compare', help="Baseline JSON file to check for regressions")
+    parser.add_argument('--threshold', type=float, default=1.25, help="Slowdown ratio reported as a regression")
+    parser.add_argument('--quick', action='store_true', help=f"Use {QUICK_PAGES}-page documents")
+    parser.add_argument('--repeat', type=int, default=5, help="Repetitions for the open and zoom scenarios")
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'pdf-comic-viewer-bench'), help="Where generated documents are kept")
+    parser.add_argument('--case', help=argparse.SUPPRESS)  # Internal, runs one case and prints its JSON
+    args = parser.parse_args()
+    for case in args.cases:
+        if case not in CASES:
+            parser.error(f"unknown case {case!r}")
+    os.makedirs(args.workdir, exist_ok=True)
+
+    if args.case:
+        print(json.dumps(run_case(args.case, args.workdir, args.quick, args.repeat)))
+        return 0
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'pymupdf': fitz.VersionBind,
+        'pillow': Image.__version__,
+        'quick': args.quick,
+        'cases': {},
+    }
+    for case in args.cases or CASES:
+        results['cases'][case] = run_isolated(case, args)
+    print_summary(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,6 @@
 import os
+import time
+STARTUP_TIME = time.perf_counter()  # For reporting time to first page
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"  # Hide pygame support prompt
 
 import sys  # Add this import if not already present
@@ -14,14 +16,1611 @@ except AssertionError:
     import pymupdf
     fitz = pymupdf
 
+import io
+import csv
 import tkinter as tk
 from tkinter import filedialog, messagebox
-from PIL import Image, ImageTk
-import pygame
+from PIL import Image, ImageTk, ImageFilter
 import zipfile
-from mutagen.mp3 import MP3  # Add this import for MP3 files
+import json
+import wave
+import atexit
+import socket
+import shutil
+import hashlib
+import sqlite3
+import queue
+import bisect
+import itertools
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import BrokenExecutor
+from multiprocessing import shared_memory
 import sys  # Add this import at the top with other imports
 
+# pygame is only imported, and its mixer started, once the music player is first used,
+# so opening a document (or reading in Quiet Mode) never pays for the audio stack
+pygame = None
+
+CBZ_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+QUALITY_INTERACTIVE = 'interactive'  # Fast scaling for previews and thumbnails
+QUALITY_FINAL = 'final'  # High quality scaling for the page the reader settles on
+# quality -> (resample filter, reducing_gap): the image is box-reduced while it stays over reducing_gap times the target
+SCALE_QUALITY = {QUALITY_INTERACTIVE: (Image.BILINEAR, 1.0), QUALITY_FINAL: (Image.LANCZOS, 3.0)}
+CBZ_CACHE_BYTES = 512 * 1024 * 1024  # Budget for decoded CBZ pages kept in memory
+FRAME_CACHE_BYTES = 384 * 1024 * 1024  # Budget for rendered frames kept for revisits and zoom changes
+ZOOM_QUANTUM = 0.01  # Zoom levels closer than this share rendered frames
+MIN_ZOOM = 0.05  # Zoom range, well clear of quantizing to zero at one end and of huge tile grids at the other
+MAX_ZOOM = 16.0
+PREVIEW_PIXELS = 400 * 600  # Size of the quick preview drawn while a page is still rendering
+TILED_RENDER_PIXELS = 4096 * 4096  # Pages larger than this at the current zoom are rendered as tiles
+TILE_SIZE = 512  # Edge length of a tile in pixels
+TILE_MARGIN = 256  # Tiles this far outside the viewport are rendered too, so scrolling finds them ready
+ZOOM_SETTLE_MS = 150  # Quiet time after the last zoom step before the page is re-rendered
+CACHE_DIR_NAME = "PDFComicViewer"
+FINGERPRINT_CHUNK = 1024 * 1024  # Bytes hashed from each end of a file to fingerprint its contents
+THUMBNAIL_WIDTH = 120
+THUMBNAIL_HEIGHT = 170
+THUMBNAIL_LABEL_HEIGHT = 16
+THUMBNAIL_PADDING = 8
+THUMBNAIL_MEMORY_BYTES = 32 * 1024 * 1024  # Thumbnails kept in memory on top of the disk cache
+THUMBNAIL_DISK_BYTES = 256 * 1024 * 1024  # Budget for the thumbnail folders on disk, the least recently used documents go first
+THUMBNAIL_PRIORITY = 10  # Thumbnails render after everything the page view is waiting for
+CROP_SAMPLE_PIXELS = 200 * 300  # Size of the small render content boxes are detected on
+CROP_THRESHOLD = 40  # Gray levels a pixel has to differ from the border color by to count as content
+CROP_NOISE = 0.01  # Rows and columns with a smaller fraction of content pixels than this are scanner noise
+CROP_MARGIN = 0.01  # Space kept around the content, as a fraction of the page
+CROP_MIN_GAIN = 0.05  # Pages whose border is less than this fraction of the page area aren't cropped
+CROP_PRIORITY = THUMBNAIL_PRIORITY - 1  # Crop detection for the rest of the document, ahead of thumbnails
+PANEL_SAMPLE_PIXELS = 400 * 600  # Size of the small render panels are detected on
+PANEL_GUTTER_INK = 0.004  # Rows and columns with less ink than this fraction are gutter, a panel's two side borders are more
+PANEL_MIN_GUTTER = 0.01  # Narrowest gutter, as a fraction of the page's shorter side
+PANEL_MIN_SIZE = 0.08  # Panels smaller than this fraction of the page in either direction are ignored
+PANEL_MAX_DEPTH = 4  # Levels of nested cuts, enough for panels split inside a tier
+SPREAD_WIDE_ASPECT = 1.0  # Pages wider than this width to height ratio are already spreads and shown alone
+SPREAD_ASPECT_TOLERANCE = 0.2  # Neighbouring pages whose aspect ratios differ by more than this fraction aren't paired
+CONTINUOUS_PAGE_GAP = 10  # Space between pages in continuous mode
+PERF_WINDOW = 50  # Samples per stage in the rolling average shown by the performance overlay
+PERF_LOG_ENV = "PDF_VIEWER_PERF_LOG"  # Set to a file path to log every timing sample as CSV
+INSTANCE_PORT = 47613  # Loopback port for the single instance handoff where Unix sockets aren't available
+INSTANCE_TIMEOUT = 2  # Seconds a launch waits for the running viewer to accept its file
+INSTANCE_POLL_MS = 250  # Polling interval for handed over files on platforms without Tk file handlers
+PLAYLIST_POLL_MS = 50  # How often scanned track durations are collected while a scan is running
+TRACK_CACHE_ENTRIES = 5000  # Tracks kept in tracks.json, the least recently scanned are dropped past this
+TRACK_END_SLACK_MS = 50  # Wait past a track's expected end before checking for the mixer's end event
+TRACK_END_CHECK_MS = 1000  # End event check interval while the current track's length is unknown
+PROGRESS_MIN_MS = 250  # Fastest progress bar refresh, used for short tracks
+PROGRESS_MAX_MS = 1000  # Slowest progress bar refresh, so the time label never skips a second
+PROGRESS_STEPS = 400  # Roughly the progress bar's width in pixels, finer updates wouldn't move it
+EXPORT_FORMATS = {'jpeg': ('JPEG', '.jpg'), 'png': ('PNG', '.png'), 'webp': ('WEBP', '.webp')}  # --format -> (Pillow format, extension)
+EXPORT_DPI = 150  # Default PDF export resolution, CBZ pages keep their own pixel size
+EXPORT_QUALITY = 85  # Default JPEG/WebP quality for exported pages
+EXPORT_PROGRESS_S = 0.5  # How often export progress is reported
+SEARCH_POLL_MS = 50  # How often search results and indexing progress are collected while the indexer is busy
+SEARCH_INDEX_BATCH = 20  # Pages extracted per index transaction, new matches are reported after each one
+SEARCH_RESULT_BATCH = 50  # Matching pages per result message, so the first hits show before the rest are read
+LIBRARY_SAVE_MS = 2000  # Reading positions are saved once the reader has stayed on a page this long
+RECENT_FILES = 15  # Entries in the recent files menu
+RENDER_WORKERS = 2  # Background threads rendering pages, and processes rasterizing PDFs for them
+RENDER_PROCESS_DOCUMENTS = 4  # PDFs each render process keeps open, for switching back and forth between documents
+PREFETCH_AHEAD = 2  # Pages rendered ahead of the current one
+PREFETCH_BEHIND = 1  # Pages rendered behind the current one
+RENDER_POLL_MS = 10  # How often finished renders are collected while any are outstanding
+
+
+def image_nbytes(img):
+    # Approximate memory used by a decoded PIL image
+    return img.width * img.height * len(img.getbands())
+
+
+def scale_image(img, size, quality=QUALITY_FINAL, box=None):
+    # Box-reduces by an integer factor first, so the resampling filter only works on a small image
+    resample, reducing_gap = SCALE_QUALITY[quality]
+    if img.mode in ('P', '1'):
+        img = img.convert('RGB')  # Pillow falls back to nearest neighbour for palette images
+    return img.resize(size, resample, box=box, reducing_gap=reducing_gap)
+
+
+def pixmap_image(size, samples, stride):
+    # Decodes MuPDF's RGB samples (a memoryview of a pixmap, or of the shared memory a render process put it in)
+    # into a PIL image backed by one contiguous block. ImageTk.PhotoImage hands such an image to Tk as it is, anything
+    # else it copies into a block first, so this is one full-frame copy per render instead of three before Tk gets the pixels
+    try:
+        img = Image.Image()._new(Image.core.new_block("RGB", size))
+    except (AttributeError, TypeError):
+        # new_block and _new are Pillow internals, checked against Pillow 11.0 and 12.3. Should a later
+        # release change them the public path still works
+        return Image.frombytes("RGB", size, samples, "raw", "RGB", stride)
+    img.frombytes(samples, "raw", "RGB", stride)
+    return img
+
+
+def page_pixmap(doc, index, zoom, clip=None):
+    # clip is an (x0, y0, x1, y1) box in output pixels, only that part of the page is rasterized
+    page = doc[index]
+    if clip is not None:
+        x0, y0, x1, y1 = clip
+        origin = page.rect.tl
+        clip = fitz.Rect(x0 / zoom, y0 / zoom, x1 / zoom, y1 / zoom) + (origin.x, origin.y, origin.x, origin.y)
+    return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, alpha=False)
+
+
+_render_docs = OrderedDict()  # identity -> document, the PDFs a render process has open, most recently used last
+
+
+def rasterize_page(identity, index, zoom, clip):
+    # Runs in a render process, which opens each document the first time it is asked for one of its pages.
+    # The pixels go back through a shared memory block rather than being pickled through a pipe,
+    # returns its name with the size and stride pixmap_image needs
+    doc = _render_docs.pop(identity, None)
+    if doc is None:
+        doc = fitz.open(identity[0])
+        while len(_render_docs) >= RENDER_PROCESS_DOCUMENTS:
+            _render_docs.popitem(last=False)[1].close()
+    _render_docs[identity] = doc
+    pix = page_pixmap(doc, index, zoom, clip)
+    samples = pix.samples_mv
+    memory = shared_memory.SharedMemory(create=True, size=max(len(samples), 1))
+    memory.buf[:len(samples)] = samples
+    memory.close()  # The viewer unlinks it once it has copied the pixels out
+    return (pix.width, pix.height), memory.name, pix.stride
+
+
+def ink_mask(gray, numpy=None):
+    # Pixels that differ from the border color, the median of the outermost pixels, so white and black
+    # borders both work. A NumPy bool array, or without NumPy a Pillow mask with 255 for ink
+    width, height = gray.size
+    if numpy is not None:
+        pixels = numpy.asarray(gray, dtype=numpy.int16)
+        background = numpy.median(numpy.concatenate((pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1])))
+        return numpy.abs(pixels - background) > CROP_THRESHOLD
+    edges = [gray.crop(box).getdata() for box in ((0, 0, width, 1), (0, height - 1, width, height),
+                                                   (0, 0, 1, height), (width - 1, 0, width, height))]
+    border = sorted(value for edge in edges for value in edge)
+    background = border[len(border) // 2]
+    return gray.point(lambda value: 255 if abs(value - background) > CROP_THRESHOLD else 0)
+
+
+def import_numpy():
+    # NumPy speeds up page analysis but isn't required
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+
+def content_box(img):
+    # The part of a page that isn't border, as (x0, y0, x1, y1) fractions of its size, None when there's
+    # no border worth cropping. Full-bleed pages come out uncropped
+    gray = img.convert("L")
+    width, height = gray.size
+    numpy = import_numpy()
+    ink = ink_mask(gray, numpy)
+    if numpy is not None:
+        rows = numpy.flatnonzero(ink.sum(axis=1) > width * CROP_NOISE)
+        columns = numpy.flatnonzero(ink.sum(axis=0) > height * CROP_NOISE)
+        if not len(rows) or not len(columns):
+            return None
+        x0, y0, x1, y1 = int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1
+    else:
+        # A 3x3 minimum filter stands in for the noise threshold
+        box = ink.filter(ImageFilter.MinFilter(3)).getbbox()
+        if box is None:
+            return None
+        x0, y0, x1, y1 = box
+    if (x1 - x0) * (y1 - y0) > (1 - CROP_MIN_GAIN) * width * height:
+        return None
+    return (max(x0 / width - CROP_MARGIN, 0.0), max(y0 / height - CROP_MARGIN, 0.0),
+            min(x1 / width + CROP_MARGIN, 1.0), min(y1 / height + CROP_MARGIN, 1.0))
+
+
+def find_panels(img):
+    # Comic panels as (x0, y0, x1, y1) page fractions in reading order, None when the page is one panel.
+    # The page is cut recursively along gutters, runs of rows or columns with next to no ink in them:
+    # first into tiers, then each tier into panels, then those again for nested layouts
+    gray = img.convert("L")
+    width, height = gray.size
+    numpy = import_numpy()
+    ink = ink_mask(gray, numpy)
+    min_gutter = max(int(min(width, height) * PANEL_MIN_GUTTER), 2)
+
+    def profile(box, rows):
+        # Ink fraction of every row (or column) of a region
+        x0, y0, x1, y1 = box
+        if numpy is not None:
+            return ink[y0:y1, x0:x1].mean(axis=1 if rows else 0)
+        size = (1, y1 - y0) if rows else (x1 - x0, 1)
+        return [value / 255 for value in ink.crop(box).resize(size, Image.BOX).getdata()]
+
+    def runs(values, minimum):
+        # (start, end) of the stretches with ink, split where a gutter is at least min_gutter long
+        if numpy is not None:
+            inked = numpy.flatnonzero(values > PANEL_GUTTER_INK)
+            if not len(inked):
+                return []
+            breaks = numpy.flatnonzero(numpy.diff(inked) > min_gutter)
+            found = zip(numpy.concatenate(([inked[0]], inked[breaks + 1])), numpy.concatenate((inked[breaks], [inked[-1]])) + 1)
+        else:
+            found = []
+            start = previous = None
+            for index, value in enumerate(values):
+                if value > PANEL_GUTTER_INK:
+                    if start is not None and index - previous > min_gutter:
+                        found.append((start, previous + 1))
+                        start = None
+                    if start is None:
+                        start = index
+                    previous = index
+            if start is not None:
+                found.append((start, previous + 1))
+        return [(int(a), int(b)) for a, b in found if b - a >= minimum]  # Page numbers and specks aren't panels
+
+    panels = []
+
+    def cut(box, rows, depth):
+        x0, y0, x1, y1 = box
+        for axis in (rows, not rows):
+            minimum = (height if axis else width) * PANEL_MIN_SIZE
+            pieces = runs(profile(box, axis), minimum)
+            if len(pieces) > 1 and depth < PANEL_MAX_DEPTH:
+                for start, end in pieces:
+                    cut((x0, y0 + start, x1, y0 + end) if axis else (x0 + start, y0, x0 + end, y1), not axis, depth + 1)
+                return
+            if len(pieces) == 1:
+                # Trim the region to its ink before trying the other direction
+                start, end = pieces[0]
+                box = x0, y0, x1, y1 = (x0, y0 + start, x1, y0 + end) if axis else (x0 + start, y0, x0 + end, y1)
+        if (x1 - x0) >= width * PANEL_MIN_SIZE and (y1 - y0) >= height * PANEL_MIN_SIZE:
+            panels.append((x0 / width, y0 / height, x1 / width, y1 / height))
+
+    cut((0, 0, width, height), True, 0)
+    return panels if len(panels) > 1 else None
+
+
+def pair_spreads(sizes):
+    # Groups pages into spreads, tuples of page numbers in reading order. The cover is shown alone,
+    # as are pages that are already wide (scanned two-page spreads) and pages shaped unlike their neighbour
+    spreads = []
+    page = 0
+    while page < len(sizes):
+        aspect = sizes[page][0] / sizes[page][1]
+        if page > 0 and page + 1 < len(sizes) and aspect <= SPREAD_WIDE_ASPECT:
+            next_aspect = sizes[page + 1][0] / sizes[page + 1][1]
+            if next_aspect <= SPREAD_WIDE_ASPECT and abs(next_aspect / aspect - 1) <= SPREAD_ASPECT_TOLERANCE:
+                spreads.append((page, page + 1))
+                page += 2
+                continue
+        spreads.append((page,))
+        page += 1
+    return spreads
+
+
+def spread_layout(document, pages):
+    # Places the pages of a spread left to right, scaled to the height of the first so they line up.
+    # Returns [(page, x offset, scale)] in unzoomed pixels and the size of the whole spread
+    height = document.page_size(pages[0])[1]
+    placed = []
+    x = 0.0
+    for page in pages:
+        width, page_height = document.page_size(page)
+        scale = height / page_height
+        placed.append((page, x, scale))
+        x += width * scale
+    return placed, (x, height)
+
+
+def render_spread(document, pages, zoom, clip=None, preview=False):
+    # Renders the pages side by side into one image, clip works like it does for a single page's render
+    placed, (width, height) = spread_layout(document, pages)
+    x0, y0, x1, y1 = clip or (0, 0, max(int(width * zoom), 1), max(int(height * zoom), 1))
+    spread = Image.new("RGB", (x1 - x0, y1 - y0), "white")
+    for page, offset, scale in placed:
+        page_zoom = zoom * scale
+        page_width, page_height = document.page_size(page)
+        left = int(offset * zoom)
+        # The part of the clip this page covers, in the page's own output pixels
+        box = (max(x0 - left, 0), y0, min(x1 - left, max(int(page_width * page_zoom), 1)), min(y1, max(int(page_height * page_zoom), 1)))
+        if box[2] <= box[0] or box[3] <= box[1]:
+            continue
+        if preview:
+            img = document.render_preview(page, page_zoom)
+        else:
+            img = document.render(page, page_zoom, None if clip is None else box)
+        spread.paste(img, (left + box[0] - x0, box[1] - y0))
+    return spread
+
+
+def quantize_zoom(zoom):
+    return round(round(zoom / ZOOM_QUANTUM) * ZOOM_QUANTUM, 4)
+
+
+def clamp_zoom(zoom):
+    return min(max(zoom, MIN_ZOOM), MAX_ZOOM)
+
+
+def cache_dir(*parts):
+    # Per-user cache directory for data kept between sessions, created on first use
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    path = os.path.join(base, CACHE_DIR_NAME, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def file_fingerprint(file_path):
+    # Content hash of the size plus the first and last chunk, so huge files don't have to be read in full
+    size = os.path.getsize(file_path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(file_path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_CHUNK))
+        if size > FINGERPRINT_CHUNK:
+            f.seek(max(size - FINGERPRINT_CHUNK, FINGERPRINT_CHUNK))
+            digest.update(f.read(FINGERPRINT_CHUNK))
+    return digest.hexdigest()
+
+
+def file_identity(file_path):
+    # Identifies a file's contents cheaply, a rewritten file gets a new identity
+    stat = os.stat(file_path)
+    return (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+
+
+def load_audio():
+    global pygame
+    if pygame is None:
+        with perf.stage('audio_init'):
+            # The event queue needs the video subsystem, a dummy driver keeps pygame from opening a window
+            os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+            import pygame as pygame_module
+            pygame_module.display.init()
+            pygame_module.mixer.init()
+            pygame_module.mixer.music.set_endevent(pygame_module.USEREVENT)  # Posted when a track ends, queued or not
+        pygame = pygame_module
+    return pygame
+
+
+class PerfStats:
+    """Per-stage timings for the render and music paths.
+
+    Keeps the last value and a rolling window for each stage, and optionally appends every
+    sample to a CSV file so timings can be collected from other machines.
+    """
+
+    def __init__(self, window=PERF_WINDOW):
+        self.window = window
+        self._samples = {}  # stage -> deque of recent durations in seconds
+        self._lock = threading.Lock()
+        self._log = None
+
+    def enable_log(self, path):
+        new_file = not os.path.exists(path)
+        self._log = open(path, 'a', newline='')
+        self._writer = csv.writer(self._log)
+        if new_file:
+            self._writer.writerow(['time', 'stage', 'ms', 'detail'])
+
+    @contextmanager
+    def stage(self, name, detail=''):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, detail)
+
+    def record(self, name, seconds, detail=''):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.window)
+            samples.append(seconds)
+            if self._log:
+                self._writer.writerow([f"{time.time():.3f}", name, f"{seconds * 1000:.3f}", detail])
+                self._log.flush()
+
+    def summary(self):
+        # [(stage, last ms, rolling average ms, samples in window)]
+        with self._lock:
+            return [(name, samples[-1] * 1000, sum(samples) / len(samples) * 1000, len(samples))
+                    for name, samples in self._samples.items()]
+
+
+perf = PerfStats()
+if os.environ.get(PERF_LOG_ENV):
+    perf.enable_log(os.environ[PERF_LOG_ENV])
+
+
+class LRUByteCache:
+    """Thread-safe LRU cache that evicts by total size in bytes rather than entry count."""
+
+    def __init__(self, max_bytes, sizeof=image_nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[1]
+            if size > self.max_bytes:
+                return  # Too large to ever fit, don't flush everything else for it
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+
+    def stats(self):
+        return {'entries': len(self._entries), 'bytes': self.total_bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+
+class CBZPageSource:
+    """Lazy page source for CBZ archives.
+
+    Only the member list is read when the archive is opened. The zip file stays open,
+    pages are decoded on demand and decoded pages are kept in a byte-bounded LRU cache.
+    """
+
+    kind = "Comic"
+
+    def __init__(self, file_path, cache_bytes=CBZ_CACHE_BYTES, names=None, sizes=None):
+        # names and sizes can come from the library, so a known archive isn't scanned again
+        self.file_path = file_path
+        self.identity = file_identity(file_path)
+        self._zip = zipfile.ZipFile(file_path, 'r')
+        self._lock = threading.Lock()  # ZipFile handles are not safe to read concurrently
+        if names is None:
+            names = sorted(f for f in self._zip.namelist() if f.lower().endswith(CBZ_IMAGE_EXTENSIONS))
+        self.names = names
+        if not self.names:
+            self._zip.close()
+            raise ValueError("No images found in archive")
+        self._sizes = dict(sizes or {})
+        self._decoded = LRUByteCache(cache_bytes)
+
+    def __len__(self):
+        return len(self.names)
+
+    def open_image(self, index):
+        # Returns a lazily decoded image, only the header has been parsed at this point
+        with self._lock:
+            data = self._zip.read(self.names[index])
+        return Image.open(io.BytesIO(data))
+
+    def page_size(self, index):
+        size = self._sizes.get(index)
+        if size is None:
+            # Image.open only parses the header, so this doesn't pull the whole member out of the archive
+            with self._lock, self._zip.open(self.names[index]) as member:
+                size = Image.open(member).size
+            self._sizes[index] = size
+        return size
+
+    def draft_scale(self, index, target):
+        # Largest JPEG DCT reduction (1/2, 1/4 or 1/8) that still decodes at least the target size
+        if target is None:
+            return 1
+        width, height = self.page_size(index)
+        for scale in (8, 4, 2):
+            if width / scale >= target[0] and height / scale >= target[1]:
+                return scale
+        return 1
+
+    def get_image(self, index, target=None):
+        # Decodes the page, JPEGs that only need to cover a much smaller target size are decoded at reduced scale
+        scale = self.draft_scale(index, target)
+        for cached_scale in (8, 4, 2, 1):
+            # A higher resolution copy that is already decoded is as good as decoding again
+            if cached_scale <= scale:
+                img = self._decoded.get((index, cached_scale))
+                if img is not None:
+                    return img
+        with perf.stage('decode', self.names[index]):
+            img = self.open_image(index)
+            if scale > 1 and img.draft(img.mode, (img.width // scale, img.height // scale)) is None:
+                scale = 1  # Not a JPEG, the decoder can't reduce
+            img.load()
+        self._decoded.put((index, scale), img)
+        return img
+
+    def render(self, index, zoom, clip=None, quality=QUALITY_FINAL):
+        width, height = self.page_size(index)
+        size = (max(int(width * zoom), 1), max(int(height * zoom), 1))
+        img = self.get_image(index, size)  # Tiles need the page decoded at the full zoomed resolution as well
+        scale = img.width / width  # Decoded pixels per page pixel, below 1 for draft decodes
+        with perf.stage('resize', f"page {index + 1}"):
+            if clip is not None:
+                x0, y0, x1, y1 = clip
+                box = tuple(value / zoom * scale for value in clip)
+                return scale_image(img, (x1 - x0, y1 - y0), quality, box=box)
+            return scale_image(img, size, quality)
+
+    def render_preview(self, index, zoom):
+        width, height = self.page_size(index)
+        size = (max(int(width * zoom), 1), max(int(height * zoom), 1))
+        scale = min(1.0, (PREVIEW_PIXELS / (size[0] * size[1])) ** 0.5)
+        preview_size = (max(int(size[0] * scale), 1), max(int(size[1] * scale), 1))
+        img = self.get_image(index, preview_size)
+        with perf.stage('preview', f"page {index + 1}"):
+            preview = scale_image(img, preview_size, QUALITY_INTERACTIVE)
+            return preview if preview.size == size else preview.resize(size, Image.BILINEAR)
+
+    def known_sizes(self):
+        return dict(self._sizes)
+
+    def close(self):
+        with self._lock:
+            self._zip.close()
+        self._decoded.clear()
+
+
+class RenderProcesses:
+    """Processes rasterizing PDF pages, shared by every document the viewer opens.
+
+    MuPDF holds the GIL for as long as it rasterizes, which would freeze the Tk thread for the whole
+    render, so pages are rasterized in separate processes and only the pixels come back. The processes
+    are started once and each opens a document the first time it renders one of its pages.
+    """
+
+    def __init__(self, workers=RENDER_WORKERS):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # Spawned rather than forked, forking a process with Tk and worker threads in it isn't safe
+        self._executor = ProcessPoolExecutor(workers, multiprocessing.get_context('spawn'))
+        self._started = [self._executor.submit(os.getpid) for _ in range(workers)]
+        self.broken = False
+
+    @property
+    def ready(self):
+        # Whether a process has started, until then documents render in the viewer's own process
+        return not self.broken and any(started.done() for started in self._started)
+
+    def rasterize(self, identity, index, zoom, clip):
+        # Returns the page as an image, copied straight out of the render process's shared memory
+        try:
+            with perf.stage('rasterize', f"page {index + 1}"):
+                size, name, stride = self._executor.submit(rasterize_page, identity, index, zoom, clip).result()
+        except BrokenExecutor:
+            self.broken = True  # A render process died, documents render in the viewer's own process from now on
+            raise
+        memory = shared_memory.SharedMemory(name)
+        try:
+            with memory.buf[:stride * size[1]] as samples:
+                with perf.stage('frombytes'):
+                    return pixmap_image(size, samples, stride)
+        finally:
+            memory.close()
+            memory.unlink()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class PDFPageSource:
+    """Page source for PDF documents, rendered with MuPDF.
+
+    Pages are rasterized in render_processes, a RenderProcesses, once it is set and has started,
+    and here otherwise.
+    """
+
+    kind = "PDF"
+
+    def __init__(self, file_path, sizes=None, render_processes=None):
+        self.file_path = file_path
+        self.identity = file_identity(file_path)
+        self._doc = fitz.open(file_path)
+        self._lock = threading.Lock()  # MuPDF documents must not be used from two threads at once
+        self._sizes = dict(sizes or {})
+        self.render_processes = render_processes
+
+    def __len__(self):
+        return len(self._doc)
+
+    def page_size(self, index):
+        size = self._sizes.get(index)
+        if size is None:
+            with self._lock:
+                rect = self._doc[index].rect
+            size = self._sizes[index] = (rect.width, rect.height)
+        return size
+
+    def render(self, index, zoom, clip=None):
+        # clip is an (x0, y0, x1, y1) box in output pixels, only that part of the page is rasterized
+        processes = self.render_processes
+        if processes is not None and processes.ready:
+            try:
+                return processes.rasterize(self.identity, index, zoom, clip)
+            except BrokenExecutor:
+                pass
+        with self._lock:
+            with perf.stage('rasterize', f"page {index + 1}"):
+                pix = page_pixmap(self._doc, index, zoom, clip)
+        with perf.stage('frombytes'):
+            return pixmap_image((pix.width, pix.height), pix.samples_mv, pix.stride)
+
+    def render_preview(self, index, zoom):
+        # Rasterize at a low resolution and stretch it to the final size
+        width, height = self.page_size(index)
+        scale = min(1.0, (PREVIEW_PIXELS / (width * height * zoom * zoom)) ** 0.5)
+        preview = self.render(index, zoom * scale)
+        with perf.stage('preview', f"page {index + 1}"):
+            return preview.resize((int(width * zoom), int(height * zoom)), Image.BILINEAR)
+
+    def close(self):
+        with self._lock:
+            self._doc.close()
+
+    def known_sizes(self):
+        return dict(self._sizes)
+
+    def page_text(self, index):
+        with self._lock:
+            return self._doc[index].get_text()
+
+    def search_page(self, index, terms):
+        # Boxes around every occurrence of the terms, in unzoomed pixels from the page's top left corner
+        with self._lock:
+            page = self._doc[index]
+            origin = page.rect.tl
+            return [(rect.x0 - origin.x, rect.y0 - origin.y, rect.x1 - origin.x, rect.y1 - origin.y)
+                    for term in terms for rect in page.search_for(term)]
+
+
+class RenderJob:
+    def __init__(self, key, func, priority, group):
+        self.key = key
+        self.func = func
+        self.priority = priority
+        self.group = group
+        self.callbacks = []
+        self.cancelled = False
+        self.started = False
+        self.result = None
+        self.error = None
+
+
+class RenderPipeline:
+    """Runs render jobs on a pool of worker threads.
+
+    Jobs are identified by a key and deduplicated, lower priority values run first and
+    queued jobs can be cancelled, either individually or by group. Finished jobs are collected by drain(), which must be
+    called from the Tk thread and is where the job callbacks run.
+    """
+
+    def __init__(self, workers=RENDER_WORKERS):
+        self._queue = queue.PriorityQueue()
+        self._done = queue.Queue()
+        self._pending = {}  # key -> RenderJob, queued or running
+        self._lock = threading.Lock()
+        self._order = itertools.count()  # FIFO order among jobs of equal priority
+        for _ in range(workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    @property
+    def busy(self):
+        return bool(self._pending) or not self._done.empty()
+
+    def submit(self, key, func, callback, priority=0, group='page'):
+        with self._lock:
+            job = self._pending.get(key)
+            if job is not None and (job.started or job.priority <= priority):
+                job.callbacks.append(callback)
+                return
+            callbacks = []
+            if job is not None:
+                # Already queued at a lower priority, requeue it rather than wait behind other work
+                job.cancelled = True
+                callbacks = job.callbacks
+            job = RenderJob(key, func, priority, group)
+            job.callbacks = callbacks + [callback]
+            self._pending[key] = job
+        self._queue.put((priority, next(self._order), job))
+
+    def cancel(self, predicate=None, group=None):
+        # Cancel queued jobs whose key matches predicate (all jobs if it is None) within group (any group
+        # if it is None), running jobs are left alone
+        with self._lock:
+            for key, job in list(self._pending.items()):
+                if job.started or (group is not None and job.group != group):
+                    continue
+                if predicate is None or predicate(key):
+                    job.cancelled = True
+                    del self._pending[key]
+
+    def drain(self):
+        while True:
+            try:
+                job = self._done.get_nowait()
+            except queue.Empty:
+                return
+            for callback in job.callbacks:
+                callback(job.key, job.result, job.error)
+
+    def _worker(self):
+        while True:
+            _, _, job = self._queue.get()
+            with self._lock:
+                if job.cancelled:
+                    continue
+                job.started = True
+            try:
+                job.result = job.func()
+            except Exception as e:
+                job.error = e
+            with self._lock:
+                if self._pending.get(job.key) is job:
+                    del self._pending[job.key]
+            self._done.put(job)
+
+
+class ThumbnailCache:
+    """On-disk thumbnail store for one document, shared across sessions.
+
+    Thumbnails live under the cache directory in a folder named after the document's
+    content fingerprint, so renamed or moved copies of a file reuse them. A folder's mtime
+    records when its document was last opened, and the first thumbnail written in a session
+    prunes the least recently used folders past THUMBNAIL_DISK_BYTES.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._directory = None
+        self._pruned = False
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self):
+        # Fingerprinting reads the file, so it is done lazily from the worker threads
+        with self._lock:
+            if self._directory is None:
+                self._directory = cache_dir('thumbnails', file_fingerprint(self.file_path))
+                try:
+                    os.utime(self._directory)  # Reading thumbnails counts as use too, not just writing them
+                except OSError:
+                    pass
+            return self._directory
+
+    def load(self, index):
+        try:
+            with Image.open(os.path.join(self.directory, f"{index}.jpg")) as img:
+                img.load()
+                return img
+        except (OSError, ValueError):
+            return None
+
+    def save(self, index, img):
+        path = os.path.join(self.directory, f"{index}.jpg")
+        try:
+            img.convert('RGB').save(path + '.tmp', 'JPEG', quality=85)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"Error saving thumbnail: {e}")
+        with self._lock:
+            prune, self._pruned = not self._pruned, True
+        if prune:
+            self.prune()
+
+    def prune(self):
+        # Removes whole document folders, oldest first, until the rest fits the budget
+        parent = os.path.dirname(self.directory)
+        folders = []
+        try:
+            for entry in os.scandir(parent):
+                if entry.is_dir() and entry.path != self.directory:
+                    size = sum(item.stat().st_size for item in os.scandir(entry.path) if item.is_file())
+                    folders.append((entry.stat().st_mtime, size, entry.path))
+            total = sum(item.stat().st_size for item in os.scandir(self.directory) if item.is_file())
+        except OSError:
+            return
+        total += sum(size for _, size, _ in folders)
+        for _, size, path in sorted(folders):
+            if total <= THUMBNAIL_DISK_BYTES:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def get_or_render(self, document, index):
+        img = self.load(index)
+        if img is None:
+            width, height = document.page_size(index)
+            img = document.render_preview(index, min(THUMBNAIL_WIDTH / width, THUMBNAIL_HEIGHT / height))
+            self.save(index, img)
+        return img
+
+
+class ThumbnailSidebar:
+    """Virtualized sidebar of page thumbnails.
+
+    The scroll region covers every page, but canvas items and PhotoImages only exist
+    for the rows in view. Rows that scroll away are deleted again.
+    """
+
+    def __init__(self, viewer, parent):
+        self.viewer = viewer
+        self.frame = tk.Frame(parent, bg='#2e2e2e')
+        self.canvas = tk.Canvas(self.frame, bg='#2e2e2e', bd=0, highlightthickness=0, width=THUMBNAIL_WIDTH + 2 * THUMBNAIL_PADDING)
+        self.scroll = tk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self.canvas.yview)
+        self.scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(side=tk.LEFT, fill=tk.Y, expand=True)
+        self.canvas.config(yscrollcommand=self.on_yscroll)
+        self.canvas.bind("<Configure>", lambda event: self.refresh())
+        self.canvas.bind("<MouseWheel>", lambda event: self.canvas.yview_scroll(-1 * int(event.delta / 120), "units"))
+        self.canvas.bind("<Button-1>", self.on_click)
+
+        self.document = None
+        self.store = None
+        self.images = LRUByteCache(THUMBNAIL_MEMORY_BYTES)  # (identity, page) -> thumbnail, saves trips to disk
+        self.rows = {}  # page -> (canvas items, PhotoImage or None) for the rows currently in view
+        self.visible = False
+
+    @property
+    def row_height(self):
+        return THUMBNAIL_HEIGHT + THUMBNAIL_LABEL_HEIGHT + THUMBNAIL_PADDING
+
+    def show(self, before):
+        self.frame.pack(side=tk.LEFT, fill=tk.Y, before=before)
+        self.visible = True
+        self.queue_all()
+        self.refresh()
+
+    def hide(self):
+        self.frame.pack_forget()
+        self.visible = False
+        self.viewer.render_pipeline.cancel(group='thumbnails')
+
+    def set_document(self, document):
+        self.clear_rows()
+        self.document = document
+        self.store = ThumbnailCache(document.file_path) if document else None
+        rows = len(document) if document else 0
+        self.canvas.config(scrollregion=(0, 0, THUMBNAIL_WIDTH + 2 * THUMBNAIL_PADDING, rows * self.row_height))
+        self.canvas.yview_moveto(0)
+        if self.visible:
+            self.queue_all()
+            self.refresh()
+
+    def clear_rows(self):
+        for items, _ in self.rows.values():
+            self.canvas.delete(*items)
+        self.rows = {}
+
+    def on_yscroll(self, first, last):
+        self.scroll.set(first, last)
+        self.refresh()
+
+    def on_click(self, event):
+        if self.document:
+            page = int(self.canvas.canvasy(event.y) // self.row_height)
+            if 0 <= page < len(self.document):
+                self.viewer.current_page = page
+                self.viewer.show_page(page)
+
+    def visible_pages(self):
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        first = max(int(top // self.row_height), 0)
+        last = min(int(bottom // self.row_height), len(self.document) - 1)
+        return range(first, last + 1)
+
+    def refresh(self):
+        if not self.visible or not self.document:
+            return
+        pages = self.visible_pages()
+        for page in list(self.rows):
+            if page not in pages:
+                self.canvas.delete(*self.rows.pop(page)[0])
+        for page in pages:
+            if page not in self.rows:
+                self.add_row(page)
+        self.highlight(self.viewer.current_page)
+
+        # Pages coming into view jump the queue, the rest keep filling the disk cache behind them
+        for page in pages:
+            self.request(page, priority=THUMBNAIL_PRIORITY)
+
+    def add_row(self, page):
+        top = page * self.row_height + THUMBNAIL_PADDING
+        center = THUMBNAIL_PADDING + THUMBNAIL_WIDTH // 2
+        outline = self.canvas.create_rectangle(THUMBNAIL_PADDING - 2, top - 2, THUMBNAIL_PADDING + THUMBNAIL_WIDTH + 2, top + THUMBNAIL_HEIGHT + 2, outline='', width=2)
+        label = self.canvas.create_text(center, top + THUMBNAIL_HEIGHT + THUMBNAIL_LABEL_HEIGHT // 2, text=str(page + 1), fill='white', font=('Arial', 9))
+        self.rows[page] = ([outline, label], None)
+        img = self.images.get((self.document.identity, page))
+        if img is not None:
+            self.place(page, img)
+
+    def place(self, page, img):
+        items, _ = self.rows[page]
+        photo = ImageTk.PhotoImage(img)
+        top = page * self.row_height + THUMBNAIL_PADDING
+        x = THUMBNAIL_PADDING + (THUMBNAIL_WIDTH - img.width) // 2
+        y = top + max(THUMBNAIL_HEIGHT - img.height, 0) // 2
+        items.append(self.canvas.create_image(x, y, anchor=tk.NW, image=photo))
+        self.rows[page] = (items, photo)
+
+    def highlight(self, current_page):
+        for page, (items, _) in self.rows.items():
+            self.canvas.itemconfig(items[0], outline='#6fa8dc' if page == current_page else '')
+
+    def request(self, page, priority):
+        if (self.document.identity, page) in self.images:
+            return
+        document, store = self.document, self.store
+        key = ('thumbnail', document.identity, page)
+        self.viewer.render_pipeline.submit(key, lambda: store.get_or_render(document, page), self.on_rendered, priority, group='thumbnails')
+        self.viewer.schedule_render_drain()
+
+    def queue_all(self):
+        if self.document:
+            for page in range(len(self.document)):
+                self.request(page, priority=THUMBNAIL_PRIORITY + 1)
+
+    def on_rendered(self, key, img, error):
+        _, identity, page = key
+        if error is not None or not self.document or identity != self.document.identity:
+            return
+        self.images.put((identity, page), img)
+        if page in self.rows and self.rows[page][1] is None:
+            self.place(page, img)
+
+
+def probe_track(file_path):
+    """Reads a track's duration and title from its headers, without decoding any audio."""
+    import mutagen
+    info = {'length': 0.0, 'title': None}
+    try:
+        audio = mutagen.File(file_path, easy=True)
+    except Exception:
+        audio = None
+    if audio is not None:
+        if audio.info is not None:
+            info['length'] = audio.info.length
+        if audio.tags:
+            title, artist = audio.tags.get('title'), audio.tags.get('artist')
+            if title:
+                info['title'] = f"{artist[0]} - {title[0]}" if artist else title[0]
+    if not info['length'] and file_path.lower().endswith('.wav'):
+        try:
+            with wave.open(file_path) as wav:
+                info['length'] = wav.getnframes() / wav.getframerate()
+        except (wave.Error, OSError, EOFError):
+            pass
+    return info
+
+
+class PlaylistScanner:
+    """Probes track durations and tags on a background thread.
+
+    Results are cached by path, size and mtime, in memory and in a JSON file in the cache
+    directory, so known tracks are never read twice. The cache is kept in least recently
+    scanned order and trimmed to TRACK_CACHE_ENTRIES. Finished results are collected on the
+    Tk thread with results().
+    """
+
+    def __init__(self):
+        self._queue = queue.PriorityQueue()
+        self._done = queue.Queue()
+        self._order = itertools.count()
+        self._cache = None  # "path|size|mtime" -> info, loaded by the worker thread
+        self._thread = None
+        self.pending = 0
+
+    def scan(self, paths, priority=1):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._worker, daemon=True)
+            self._thread.start()
+        for path in paths:
+            self.pending += 1
+            self._queue.put((priority, next(self._order), path))
+
+    def results(self):
+        # [(path, info)] finished since the last call, info is None for unreadable files
+        finished = []
+        while True:
+            try:
+                finished.append(self._done.get_nowait())
+            except queue.Empty:
+                break
+        self.pending -= len(finished)
+        return finished
+
+    @property
+    def cache_path(self):
+        return os.path.join(cache_dir(), 'tracks.json')
+
+    def _worker(self):
+        try:
+            with open(self.cache_path) as f:
+                self._cache = json.load(f)
+        except (OSError, ValueError):
+            self._cache = {}
+        dirty = False
+        while True:
+            if dirty and self._queue.empty():
+                self._save()
+                dirty = False
+            _, _, path = self._queue.get()
+            try:
+                stat = os.stat(path)
+                key = f"{path}|{stat.st_size}|{stat.st_mtime_ns}"
+                info = self._cache.pop(key, None)
+                if info is None:
+                    with perf.stage('music_probe', os.path.basename(path)):
+                        info = probe_track(path)
+                    dirty = True
+                self._cache[key] = info  # Most recently scanned last, the order is written out with the next save
+            except OSError:
+                info = None
+            self._done.put((path, info))
+
+    def _save(self):
+        # Entries for files that have changed since, or that haven't been scanned in a long time, go first
+        latest = {key.rsplit('|', 2)[0]: key for key in self._cache}
+        self._cache = {key: info for key, info in self._cache.items() if latest[key.rsplit('|', 2)[0]] == key}
+        for key in list(itertools.islice(self._cache, max(len(self._cache) - TRACK_CACHE_ENTRIES, 0))):
+            del self._cache[key]
+        try:
+            with open(self.cache_path + '.tmp', 'w') as f:
+                json.dump(self._cache, f)
+            os.replace(self.cache_path + '.tmp', self.cache_path)
+        except OSError as e:
+            print(f"Error saving track cache: {e}")
+
+
+class SearchIndex:
+    """Full-text index of PDF pages in an SQLite FTS5 database in the cache directory.
+
+    Page text is extracted on a background thread and stored under the document's content
+    fingerprint, so a document indexed once can be searched straight away in later sessions,
+    and an interrupted one picks up where it stopped. Progress and matching pages are
+    collected on the Tk thread with results().
+    """
+
+    def __init__(self):
+        self._requests = queue.Queue()
+        self._done = queue.Queue()
+        self._thread = None
+        self._requested = 0  # Requests made, the worker reports back how many it has seen when it goes idle
+        self.busy = False
+        self.error = None  # Why search is unavailable, e.g. an SQLite built without FTS5
+
+    def index(self, document):
+        # Starts indexing a document, None stops indexing the previous one
+        self._request(('index', document))
+
+    def search(self, document, query):
+        self._request(('search', document, query))
+
+    def _request(self, request):
+        if self.error:
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._worker, daemon=True)
+            self._thread.start()
+        self._requested += 1
+        self.busy = True
+        self._requests.put(request)
+
+    def results(self):
+        # [(document, 'progress', (indexed, pages)) or (document, 'hits', (query, [page, ...]))]
+        finished = []
+        while True:
+            try:
+                message = self._done.get_nowait()
+            except queue.Empty:
+                break
+            if message[1] == 'idle':
+                self.busy = message[2] != self._requested
+            elif message[1] == 'error':
+                self.error = message[2]
+                self.busy = False
+            else:
+                finished.append(message)
+        return finished
+
+    @staticmethod
+    def match_expression(fingerprint, query):
+        # Every word has to appear on the page, each as a word prefix, within this document only
+        terms = ' AND '.join('"' + word.replace('"', '""') + '"*' for word in query.split())
+        return f'fingerprint : "{fingerprint}" AND text : ({terms})'
+
+    def _connect(self):
+        db = sqlite3.connect(os.path.join(cache_dir(), 'search.sqlite'))
+        db.execute("CREATE TABLE IF NOT EXISTS documents (fingerprint TEXT PRIMARY KEY, indexed INTEGER)")
+        db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS pages USING fts5(fingerprint, page UNINDEXED, text)")
+        return db
+
+    def _worker(self):
+        try:
+            db = self._connect()
+        except sqlite3.Error as e:
+            self._done.put((None, 'error', f"search unavailable: {e}"))
+            return
+        seen = 0
+        document = fingerprint = None
+        indexed = count = 0
+        query = None
+        while True:
+            idle = document is None or indexed >= count
+            if idle and self._requests.empty():
+                self._done.put((None, 'idle', seen))
+            try:
+                request = self._requests.get(block=idle)
+            except queue.Empty:
+                request = None
+            if request is not None:
+                seen += 1
+                if request[0] == 'index':
+                    document, query = request[1], None
+                    try:
+                        fingerprint = file_fingerprint(document.file_path) if document else None
+                    except OSError:
+                        document = fingerprint = None
+                    if fingerprint:
+                        row = db.execute("SELECT indexed FROM documents WHERE fingerprint = ?", (fingerprint,)).fetchone()
+                        indexed, count = (row[0] if row else 0), len(document)
+                        self._done.put((document, 'progress', (indexed, count)))
+                elif request[1] is document and fingerprint:
+                    query = request[2]
+                    self._report_hits(db, document, fingerprint, query, 0, indexed)
+                continue
+
+            # Extract the next batch of pages, a closed document just stops the indexing
+            end = min(indexed + SEARCH_INDEX_BATCH, count)
+            try:
+                with perf.stage('search_index', f"pages {indexed + 1}-{end}"):
+                    rows = [(fingerprint, page, document.page_text(page)) for page in range(indexed, end)]
+            except Exception:
+                document = None
+                continue
+            with db:
+                # Rows left over from an interrupted run, found through the index rather than a scan of every document's pages
+                db.execute("DELETE FROM pages WHERE rowid IN (SELECT rowid FROM pages WHERE pages MATCH ?) AND page >= ?",
+                           (f'fingerprint : "{fingerprint}"', indexed))
+                db.executemany("INSERT INTO pages (fingerprint, page, text) VALUES (?, ?, ?)", rows)
+                db.execute("INSERT OR REPLACE INTO documents (fingerprint, indexed) VALUES (?, ?)", (fingerprint, end))
+            if query:
+                self._report_hits(db, document, fingerprint, query, indexed, end)
+            indexed = end
+            self._done.put((document, 'progress', (indexed, count)))
+
+    def _report_hits(self, db, document, fingerprint, query, first, end):
+        # Streams the matching pages in [first, end) back in batches, in page order
+        try:
+            cursor = db.execute("SELECT page FROM pages WHERE pages MATCH ? AND page >= ? AND page < ? ORDER BY page",
+                                (self.match_expression(fingerprint, query), first, end))
+            while True:
+                pages = [row[0] for row in cursor.fetchmany(SEARCH_RESULT_BATCH)]
+                self._done.put((document, 'hits', (query, pages)))
+                if len(pages) < SEARCH_RESULT_BATCH:
+                    break
+        except sqlite3.Error as e:
+            print(f"Error searching: {e}")
+
+
+class Library:
+    """Reading positions and document metadata in an SQLite database in the cache directory.
+
+    Entries are keyed by path and only trusted while the file's size and mtime still match,
+    so a replaced file is scanned from scratch. The recent files list is read from here
+    without opening any documents. Used from the Tk thread only.
+    """
+
+    def __init__(self):
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = sqlite3.connect(os.path.join(cache_dir(), 'library.sqlite'))
+            self._db.execute("""CREATE TABLE IF NOT EXISTS documents (
+                path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, kind TEXT, pages INTEGER,
+                manifest TEXT, sizes TEXT, last_page INTEGER, zoom REAL, fit_mode TEXT, opened_at REAL, crops TEXT, panels TEXT)""")
+            for column in ('crops', 'panels'):
+                try:
+                    self._db.execute(f"ALTER TABLE documents ADD COLUMN {column} TEXT")  # Libraries from older versions
+                except sqlite3.OperationalError:
+                    pass  # Already there
+        return self._db
+
+    def lookup(self, file_path):
+        # The stored entry for a file, None when it's unknown or has changed since
+        try:
+            path, size, mtime_ns = file_identity(file_path)
+            row = self.db.execute("SELECT size, mtime_ns, manifest, sizes, last_page, zoom, fit_mode, crops, panels FROM documents WHERE path = ?",
+                                  (path,)).fetchone()
+        except (OSError, sqlite3.Error):
+            return None
+        if row is None or (row[0], row[1]) != (size, mtime_ns):
+            return None
+        manifest, sizes, last_page, zoom, fit_mode, crops, panels = row[2:]
+        return {'names': json.loads(manifest) if manifest else None,
+                'sizes': {int(index): tuple(size) for index, size in json.loads(sizes or '{}').items()},
+                'crops': {int(index): box and tuple(box) for index, box in json.loads(crops or '{}').items()},
+                'panels': {int(index): boxes and [tuple(box) for box in boxes] for index, boxes in json.loads(panels or '{}').items()},
+                'last_page': last_page, 'zoom': zoom, 'fit_mode': fit_mode}
+
+    def save(self, document, page, zoom, fit_mode, crops, panels):
+        path, size, mtime_ns = document.identity
+        manifest = json.dumps(document.names) if isinstance(document, CBZPageSource) else None
+        try:
+            with self.db:
+                self.db.execute("INSERT OR REPLACE INTO documents (path, size, mtime_ns, kind, pages, manifest, sizes, last_page, "
+                                "zoom, fit_mode, opened_at, crops, panels) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                (path, size, mtime_ns, document.kind, len(document), manifest, json.dumps(document.known_sizes()),
+                                 page, zoom, fit_mode, time.time(), json.dumps(crops), json.dumps(panels)))
+        except sqlite3.Error as e:
+            print(f"Error saving reading position: {e}")
+
+    def recent(self, limit=RECENT_FILES):
+        # [(path, pages, last_page)] most recently read first
+        try:
+            return self.db.execute("SELECT path, pages, last_page FROM documents ORDER BY opened_at DESC LIMIT ?", (limit,)).fetchall()
+        except sqlite3.Error:
+            return []
+
+
+def instance_address():
+    # A Unix domain socket where available, a fixed loopback port otherwise
+    if hasattr(socket, 'AF_UNIX'):
+        directory = os.environ.get('XDG_RUNTIME_DIR')
+        if not directory:
+            # Not the shared temporary directory, where anyone could claim the name first and collect the handed over paths
+            directory = cache_dir('run')
+            os.chmod(directory, 0o700)
+        user = os.getuid() if hasattr(os, 'getuid') else os.environ.get('USERNAME', 'user')
+        return socket.AF_UNIX, os.path.join(directory, f"pdf-comic-viewer-{user}.sock")
+    return socket.AF_INET, ('127.0.0.1', INSTANCE_PORT)
+
+
+def send_to_running_instance(file_path):
+    """Hand file_path to an already running viewer. Returns False if there is none."""
+    family, address = instance_address()
+    try:
+        with socket.socket(family, socket.SOCK_STREAM) as client:
+            client.settimeout(INSTANCE_TIMEOUT)
+            client.connect(address)
+            client.sendall(os.path.abspath(file_path).encode('utf-8') + b"\n")
+            return client.recv(16).startswith(b"ok")
+    except OSError:
+        return False
+
+
+class InstanceServer:
+    """Accepts file paths from later launches and opens them in this viewer.
+
+    On platforms with Tk file handlers the listening socket and the connections are watched
+    by the Tk event loop directly and read without blocking, elsewhere a thread accepts and
+    reads connections and the Tk thread polls for the paths.
+    """
+
+    def __init__(self, root, open_path):
+        self.root = root
+        self.open_path = open_path
+        family, self.address = instance_address()
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.socket_file = None  # (inode, ctime) of the socket file this server created, so close() never removes another viewer's
+        if family == socket.AF_UNIX and os.path.exists(self.address):
+            # Only stale when nothing listens on it any more, a busy viewer may just have missed the handoff timeout.
+            # A live one is left alone and bind fails
+            with socket.socket(family, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(self.address)
+                except ConnectionRefusedError:
+                    os.unlink(self.address)
+                except FileNotFoundError:
+                    pass
+        self.sock.bind(self.address)
+        self.sock.listen(8)
+        if family == socket.AF_UNIX:
+            os.chmod(self.address, 0o600)
+            self.socket_file = self.file_identity()
+            atexit.register(self.close)
+
+        if hasattr(root.tk, 'createfilehandler'):
+            root.tk.createfilehandler(self.sock, tk.READABLE, lambda sock, mask: self.accept())
+        else:
+            self.paths = queue.Queue()
+            threading.Thread(target=self.accept_loop, daemon=True).start()
+            self.poll()
+
+    def read_path(self, connection):
+        with connection:
+            connection.settimeout(INSTANCE_TIMEOUT)
+            data = b""
+            while not data.endswith(b"\n"):
+                chunk = connection.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+            connection.sendall(b"ok\n")
+        return data.decode('utf-8').strip()
+
+    def accept(self):
+        # A launch that connects and then says nothing must not hold up the Tk thread, so the connection is
+        # read as data arrives and dropped if the path isn't complete within the timeout
+        try:
+            connection, _ = self.sock.accept()
+        except OSError:
+            return
+        connection.setblocking(False)
+        data = bytearray()
+        timeout_id = self.root.after(INSTANCE_TIMEOUT * 1000, lambda: self.finish(connection))
+        self.root.tk.createfilehandler(connection, tk.READABLE, lambda sock, mask: self.receive(connection, data, timeout_id))
+
+    def receive(self, connection, data, timeout_id):
+        try:
+            chunk = connection.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            chunk = b""
+        data += chunk
+        if chunk and not data.endswith(b"\n"):
+            return
+        self.root.after_cancel(timeout_id)
+        self.finish(connection, bytes(data) if chunk else None)
+
+    def finish(self, connection, data=None):
+        self.root.tk.deletefilehandler(connection)
+        with connection:
+            if data is not None:
+                try:
+                    connection.sendall(b"ok\n")  # Fits the empty send buffer of a fresh connection
+                except OSError:
+                    pass
+        file_path = data.decode('utf-8', 'replace').strip() if data else ""
+        if file_path:
+            self.activate(file_path)
+
+    def accept_loop(self):
+        while True:
+            try:
+                connection, _ = self.sock.accept()
+            except OSError:
+                return
+            try:
+                self.paths.put(self.read_path(connection))
+            except OSError:
+                pass  # A launch that gave up, keep serving the next one
+
+    def poll(self):
+        while not self.paths.empty():
+            file_path = self.paths.get()
+            if file_path:
+                self.activate(file_path)
+        self.root.after(INSTANCE_POLL_MS, self.poll)
+
+    def activate(self, file_path):
+        # Bring the window forward and show the new document
+        self.root.deiconify()
+        self.root.lift()
+        self.root.focus_force()
+        self.open_path(file_path)
+
+    def close(self):
+        self.sock.close()
+        try:
+            if self.socket_file is not None and self.file_identity() == self.socket_file:
+                os.unlink(self.address)
+        except FileNotFoundError:
+            pass
+
+    def file_identity(self):
+        # Inode numbers are reused as soon as a file is removed, the change time tells a replacement apart
+        status = os.stat(self.address)
+        return status.st_ino, status.st_ctime_ns
+
+
+_export_source = None  # The document a batch export worker renders from, opened once per process
+_export_options = None
+
+
+def open_export_source(file_path):
+    if file_path.lower().endswith('.cbz'):
+        return CBZPageSource(file_path, cache_bytes=0)  # Every page is decoded exactly once, nothing to cache
+    return PDFPageSource(file_path)
+
+
+def init_export_worker(file_path, options):
+    global _export_source, _export_options
+    _export_source = open_export_source(file_path)
+    _export_options = options
+
+
+def export_page(index):
+    # Runs in an export worker, renders one page and returns it encoded
+    dpi, max_height, format, quality = _export_options
+    width, height = _export_source.page_size(index)
+    zoom = dpi / 72 if isinstance(_export_source, PDFPageSource) else 1.0
+    if max_height and height * zoom > max_height:
+        zoom = max_height / height
+    img = _export_source.render(index, zoom)
+    if img.mode not in ('RGB', 'L') and format != 'png':
+        img = img.convert('RGB')  # JPEG has no alpha or palette
+    buffer = io.BytesIO()
+    img.save(buffer, EXPORT_FORMATS[format][0], quality=quality)
+    return index, buffer.getvalue()
+
+
+def export_document(file_path, target, images=False, dpi=EXPORT_DPI, max_height=None, format='jpeg',
+                    quality=EXPORT_QUALITY, workers=None):
+    """Renders every page of a PDF or CBZ into a CBZ archive, or a folder of images.
+
+    Pages are rendered by a pool of processes that each keep their own copy of the document
+    open, and written out as they arrive. Returns (pages, seconds).
+    """
+    import multiprocessing
+
+    source = open_export_source(file_path)
+    count = len(source)
+    source.close()
+    workers = max(min(workers or os.cpu_count() or 1, count), 1)
+    options = (dpi, max_height, format, quality)
+    extension = EXPORT_FORMATS[format][1]
+    digits = len(str(count))
+    name = os.path.basename(file_path)
+
+    start = time.perf_counter()
+    reported = start
+    written = 0
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, init_export_worker, (file_path, options))
+        # Results come back in page order so the archive is too, workers keep rendering ahead meanwhile.
+        # Chunks amortize the handoff on long documents while keeping every worker busy until the end
+        pages = pool.imap(export_page, range(count), max(1, min(8, count // (workers * 4))))
+    else:
+        init_export_worker(file_path, options)
+        pages = map(export_page, range(count))
+    # Everything is written next to the target first and only moved into place once every page is there,
+    # so a failed export leaves neither a truncated archive nor a clobbered earlier export behind
+    partial = target + '.part'
+    archive = None
+    finished = False
+    try:
+        if images:
+            os.makedirs(partial, exist_ok=True)
+        else:
+            archive = zipfile.ZipFile(partial, 'w', zipfile.ZIP_STORED)  # Page images are already compressed
+        for done, (index, data) in enumerate(pages, 1):
+            member = f"page{index + 1:0{digits}}{extension}"
+            if archive is not None:
+                archive.writestr(member, data)
+            else:
+                with open(os.path.join(partial, member), 'wb') as f:
+                    f.write(data)
+            written += len(data)
+            now = time.perf_counter()
+            if now - reported >= EXPORT_PROGRESS_S or done == count:
+                reported = now
+                print(f"\r{name}: {done}/{count} pages, {done / (now - start):.1f} pages/s, "
+                      f"{written / 2 ** 20 / (now - start):.1f} MB/s", end='', file=sys.stderr, flush=True)
+        if archive is not None:
+            archive.close()
+            archive = None
+            os.replace(partial, target)
+        else:
+            os.makedirs(target, exist_ok=True)
+            for member in os.listdir(partial):
+                os.replace(os.path.join(partial, member), os.path.join(target, member))
+            os.rmdir(partial)
+        finished = True
+    finally:
+        if archive is not None:
+            archive.close()
+        if not finished:
+            if images:
+                shutil.rmtree(partial, ignore_errors=True)
+            elif os.path.exists(partial):
+                os.remove(partial)
+        if pool is not None:
+            pool.terminate()
+        elif _export_source is not None:
+            _export_source.close()
+    print(file=sys.stderr)
+    return count, time.perf_counter() - start
+
+
+def export_target(file_path, output, images, several):
+    # Where one input's pages go, -o names it directly for a single input and is a folder for several
+    if output and not several:
+        return output
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    folder = output or os.path.dirname(os.path.abspath(file_path))
+    return os.path.join(folder, stem if images else stem + '.cbz')
+
+
+def export_main(argv):
+    import argparse
+
+    def positive(convert, maximum=None):
+        def parse(text):
+            value = convert(text)
+            if value <= 0 or (maximum is not None and value > maximum):
+                raise argparse.ArgumentTypeError(f"must be between 1 and {maximum}" if maximum else "must be positive")
+            return value
+        return parse
+
+    parser = argparse.ArgumentParser(prog="viewer.py --export",
+                                     description="Render PDFs and CBZs into CBZ archives or image folders without opening the viewer")
+    parser.add_argument('inputs', nargs='+', help="PDF or CBZ files")
+    parser.add_argument('-o', '--output', help="Output archive or folder, a folder when there are several inputs "
+                                               "(default: next to each input)")
+    parser.add_argument('--images', action='store_true', help="Write loose image files instead of a CBZ")
+    parser.add_argument('--dpi', type=positive(float), default=EXPORT_DPI, help=f"PDF render resolution (default {EXPORT_DPI})")
+    parser.add_argument('--max-height', type=positive(int), help="Scale pages down to at most this many pixels high")
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='jpeg', help="Image format (default jpeg)")
+    parser.add_argument('--quality', type=positive(int, 100), default=EXPORT_QUALITY, help=f"JPEG/WebP quality (default {EXPORT_QUALITY})")
+    parser.add_argument('-j', '--workers', type=positive(int), help="Worker processes (default: one per core)")
+    args = parser.parse_args(argv)
+
+    several = len(args.inputs) > 1
+    # Inputs that only differ in folder or extension would overwrite each other's output, caught before anything is rendered
+    sources = {}
+    for file_path in args.inputs:
+        sources.setdefault(os.path.abspath(export_target(file_path, args.output, args.images, several)), []).append(file_path)
+    for target, paths in sources.items():
+        if len(paths) > 1:
+            parser.error(f"{', '.join(paths)} would all be exported to {target}, export them separately")
+    if several and args.output:
+        os.makedirs(args.output, exist_ok=True)
+    failed = 0
+    total_pages = 0
+    start = time.perf_counter()
+    for file_path in args.inputs:
+        target = export_target(file_path, args.output, args.images, several)
+        if os.path.abspath(target) == os.path.abspath(file_path):
+            print(f"{file_path}: output would overwrite the input, use -o", file=sys.stderr)
+            failed += 1
+            continue
+        try:
+            pages, seconds = export_document(file_path, target, args.images, args.dpi, args.max_height,
+                                             args.format, args.quality, args.workers)
+        except Exception as e:
+            print(f"{file_path}: {e}", file=sys.stderr)
+            failed += 1
+            continue
+        total_pages += pages
+        print(f"{target}: {pages} pages in {seconds:.1f} s")
+    if several:
+        elapsed = time.perf_counter() - start
+        print(f"{total_pages} pages in {elapsed:.1f} s, {total_pages / elapsed:.1f} pages/s")
+    return 1 if failed else 0
+
+
 class PDFViewer:
     def __init__(self, root):
         self.root = root
@@ -29,21 +1628,64 @@ class PDFViewer:
         self.root.configure(bg='#2e2e2e')  # Dark gray background
         
         # Initialize variables
-        self.pdf_document = None
-        self.cbz_images = []
+        self.document = None  # PDFPageSource or CBZPageSource
         self.current_page = 0
         self.photo = None
         self.zoom_level = 1.0  # Default zoom level for both PDF and images
+        self.render_pipeline = RenderPipeline()
+        self.render_drain_id = None
+        self.render_processes = None  # RenderProcesses, started once the first PDF page is on screen
+        self.frames = LRUByteCache(FRAME_CACHE_BYTES)  # (document identity, page, zoom) -> rendered PIL image
+        self.shown_key = None  # Frame the canvas is currently waiting for or showing
+        self.page_requested_at = None  # When show_page was called for shown_key, until it is first drawn
+        self.perf_overlay = False  # Timing overlay toggled with F12
+        self.first_page_shown = False
+        self.reset_view_pending = True  # Whether the next frame drawn for shown_key scrolls back to the top
+        self.zoom_base = None  # (image, zoom) last drawn from a real render, scaled for instant zoom feedback
+        self.zoom_render_id = None
+        self.fit_mode = None  # 'width' or 'height' while the zoom follows the window size
+        self.continuous = False  # Continuous vertical scroll through all pages instead of one page at a time
+        self.continuous_layout = None  # Page positions at the zoom level the continuous view was laid out for
+        self.continuous_items = {}  # page -> (placeholder item, image item, PhotoImage) for pages near the viewport
+        self.continuous_pool = []  # (placeholder item, image item) pairs waiting to be reused
+        self.tiled_view = None  # (key, page, zoom, x, y, width, height) while the page is shown as tiles
+        self.tile_items = {}  # (column, row) -> (canvas item, PhotoImage) for tiles currently on the canvas
+        self.viewport_update_id = None
+        self.page_origins = []  # (page, x, y, zoom) of each page of the single page or spread on the canvas, for placing search hits
+        self.search_index = SearchIndex()
+        self.search_poll_id = None
+        self.search_query = None  # The query whose hits are shown
+        self.search_pages = []  # Sorted pages matching search_query, grows as results stream in
+        self.search_rects = {}  # page -> hit boxes in unzoomed page pixels, found by the render workers when the page is first shown
+        self.index_progress = None  # (pages indexed, pages) for the open PDF
+        self.auto_crop = False  # Fit to each page's content instead of the whole page
+        self.crop_boxes = {}  # page -> content box as page fractions, None for pages without a border
+        self.panel_view = False  # Guided view, paging moves from panel to panel
+        self.panels = {}  # page -> panel boxes as page fractions in reading order, None for single panel pages
+        self.panel_page = None  # The page panel_index is for
+        self.panel_index = 0
+        self.page_wait = None  # (page, reset_view, panel) being shown once its content box and panels are known
+        self.panel_cuts = None  # (frame key, [panel image]) of the page on screen, cut ahead at full quality
+        self.spread_mode = False  # Pages shown in pairs side by side, the cover and wide pages alone
+        self.right_to_left = False  # Manga order, spreads are composed and the arrows turn pages right to left
+        self.spread_table = None  # (spreads, page -> spread index) for the open document, paired when first needed
+        self.library = Library()
+        self.library_save_id = None
+        atexit.register(self.save_reading_position)
         self.music_files = []  # List of music files
         self.current_music_index = -1
         self.music_playing = False
-        self.music_length = 0  # Length of the current music file in seconds
+        self.music_paused = False  # Paused mid-track, play resumes instead of restarting
+        self.music_offset = (0.0, 0)  # (track position in seconds, mixer get_pos() in ms) at the last start or seek
+        self.track_end_id = None
+        self.music_progress_id = None
+        self.music_length = 0  # Length of the current music file in seconds, 0 until the scanner has read it
+        self.track_info = {}  # path -> {'length', 'title'} as reported by the playlist scanner
+        self.playlist_scanner = PlaylistScanner()
+        self.playlist_poll_id = None
         self.comic_mode = False  # Comic viewing mode toggle
         self.dragging = False  # Initialize dragging flag
 
-        # Initialize pygame mixer
-        pygame.mixer.init()
-
         # Create a frame for the main layout
         self.main_frame = tk.Frame(self.root, bg='#2e2e2e')
         self.main_frame.pack(fill=tk.BOTH, expand=True)
@@ -61,10 +1703,13 @@ class PDFViewer:
         self.canvas.bind("<Shift-MouseWheel>", self.on_shift_mouse_wheel)
         self.canvas.bind("<Control-MouseWheel>", self.on_ctrl_mouse_wheel)  # Add this line
 
+        # Thumbnail sidebar, packed to the left of the canvas when enabled
+        self.thumbnail_sidebar = ThumbnailSidebar(self, self.canvas_scroll_frame)
+
         # Vertical Scrollbar
         self.v_scroll = tk.Scrollbar(self.canvas_scroll_frame, orient=tk.VERTICAL, command=self.canvas.yview)
         self.v_scroll.pack(side=tk.RIGHT, fill=tk.Y)
-        self.canvas.config(yscrollcommand=self.v_scroll.set)
+        self.canvas.config(yscrollcommand=self.on_canvas_yscroll)
 
         # Horizontal Scrollbar Frame
         self.h_scroll_frame = tk.Frame(self.main_frame, bg='#2e2e2e')
@@ -73,7 +1718,8 @@ class PDFViewer:
         # Horizontal Scrollbar
         self.h_scroll = tk.Scrollbar(self.h_scroll_frame, orient=tk.HORIZONTAL, command=self.canvas.xview)
         self.h_scroll.pack(side=tk.BOTTOM, fill=tk.X)
-        self.canvas.config(xscrollcommand=self.h_scroll.set)
+        self.canvas.config(xscrollcommand=self.on_canvas_xscroll)
+        self.canvas.bind("<Configure>", self.on_canvas_configure)
 
         # Create top section frame
         self.top_section = tk.Frame(self.root, bg='#2e2e2e')  # Match the root background color
@@ -106,9 +1752,9 @@ class PDFViewer:
 
         # Create buttons with proper alignment
         buttons = [
-            ("◄", self.prev_page),
+            ("◄", self.page_left),
             ("Open PDF/CBZ", self.open_file),
-            ("►", self.next_page),
+            ("►", self.page_right),
             ("Zoom In", self.zoom_in),
             ("Zoom Out", self.zoom_out),
             ("Fit Width", self.fit_width),
@@ -118,11 +1764,25 @@ class PDFViewer:
         for text, command in buttons:
             tk.Button(self.button_frame, text=text, command=command, **button_style).pack(side=tk.LEFT, padx=5, pady=5)
 
+        # Recently read files, listed from the library when the menu opens
+        self.recent_button = tk.Menubutton(self.button_frame, text="Recent", **button_style)
+        self.recent_menu = tk.Menu(self.recent_button, tearoff=0, postcommand=self.update_recent_menu)
+        self.recent_button.config(menu=self.recent_menu)
+        self.recent_button.pack(side=tk.LEFT, padx=5, pady=5)
+
         # Add Jump to Page button and entry
         self.page_entry = tk.Entry(self.button_frame, width=5)
         self.page_entry.pack(side=tk.LEFT, padx=5, pady=5)
         tk.Button(self.button_frame, text="Go", command=self.jump_to_page, **button_style).pack(side=tk.LEFT, padx=5, pady=5)
 
+        # Add text search, Enter searches and F3 / Shift+F3 step through the matching pages
+        self.search_entry = tk.Entry(self.button_frame, width=20)
+        self.search_entry.pack(side=tk.LEFT, padx=5, pady=5)
+        self.search_entry.bind("<Return>", self.search)
+        tk.Button(self.button_frame, text="Find", command=self.search, **button_style).pack(side=tk.LEFT, padx=5, pady=5)
+        self.search_label = tk.Label(self.button_frame, text="", bg='#2e2e2e', fg='white', font=('Arial', 10))
+        self.search_label.pack(side=tk.LEFT, padx=5)
+
         # Center align the buttons
         self.button_frame.pack(side=tk.TOP, fill=tk.X, padx=10)
 
@@ -130,6 +1790,34 @@ class PDFViewer:
         self.comic_mode_button = tk.Checkbutton(self.button_frame, text="Quiet Mode", bg='#4e4e4e', fg='white', font=('Arial', 10, 'bold'), command=self.toggle_comic_mode)
         self.comic_mode_button.pack(side=tk.RIGHT, padx=10)
 
+        # Add toggle for continuous scrolling
+        self.continuous_var = tk.BooleanVar(value=False)
+        self.continuous_button = tk.Checkbutton(self.button_frame, text="Continuous", variable=self.continuous_var, bg='#4e4e4e', fg='white', font=('Arial', 10, 'bold'), command=self.apply_continuous)
+        self.continuous_button.pack(side=tk.RIGHT, padx=10)
+
+        # Add toggle for automatic margin cropping
+        self.auto_crop_var = tk.BooleanVar(value=False)
+        self.auto_crop_button = tk.Checkbutton(self.button_frame, text="Auto Crop", variable=self.auto_crop_var, bg='#4e4e4e', fg='white', font=('Arial', 10, 'bold'), command=self.apply_auto_crop)
+        self.auto_crop_button.pack(side=tk.RIGHT, padx=10)
+
+        # Add toggle for guided panel by panel view
+        self.panel_view_var = tk.BooleanVar(value=False)
+        self.panel_view_button = tk.Checkbutton(self.button_frame, text="Panels", variable=self.panel_view_var, bg='#4e4e4e', fg='white', font=('Arial', 10, 'bold'), command=self.apply_panel_view)
+        self.panel_view_button.pack(side=tk.RIGHT, padx=10)
+
+        # Add toggles for two page spreads and right to left reading
+        self.spread_var = tk.BooleanVar(value=False)
+        self.spread_button = tk.Checkbutton(self.button_frame, text="Spreads", variable=self.spread_var, bg='#4e4e4e', fg='white', font=('Arial', 10, 'bold'), command=self.apply_spreads)
+        self.spread_button.pack(side=tk.RIGHT, padx=10)
+        self.right_to_left_var = tk.BooleanVar(value=False)
+        self.right_to_left_button = tk.Checkbutton(self.button_frame, text="Right to Left", variable=self.right_to_left_var, bg='#4e4e4e', fg='white', font=('Arial', 10, 'bold'), command=self.apply_right_to_left)
+        self.right_to_left_button.pack(side=tk.RIGHT, padx=10)
+
+        # Add toggle for the thumbnail sidebar
+        self.thumbnails_var = tk.BooleanVar(value=False)
+        self.thumbnails_button = tk.Checkbutton(self.button_frame, text="Thumbnails", variable=self.thumbnails_var, bg='#4e4e4e', fg='white', font=('Arial', 10, 'bold'), command=self.apply_thumbnails)
+        self.thumbnails_button.pack(side=tk.RIGHT, padx=10)
+
         # Music Player Frame
         self.music_frame = tk.Frame(self.root, bg='#2e2e2e')
         self.music_frame.pack(side=tk.BOTTOM, fill=tk.X, pady=5)
@@ -160,33 +1848,29 @@ class PDFViewer:
         self.total_time_label.pack(side=tk.LEFT, padx=5)
 
         # Bind keyboard events
-        self.root.bind("<Right>", self.next_page_key)
-        self.root.bind("<Left>", self.prev_page_key)
+        self.root.bind("<Right>", self.page_right_key)
+        self.root.bind("<Left>", self.page_left_key)
         self.root.bind("<space>", self.toggle_play_pause_music)
         self.root.bind("<Control-Right>", self.next_music_key)
         self.root.bind("<F11>", self.toggle_fullscreen)
+        self.root.bind("<F12>", self.toggle_perf_overlay)
+        self.root.bind("<F9>", self.toggle_thumbnails)
+        self.root.bind("<F8>", self.toggle_continuous)
+        self.root.bind("<F7>", self.toggle_auto_crop)
+        self.root.bind("<F6>", self.toggle_panel_view)
+        self.root.bind("<F5>", self.toggle_spreads)
+        self.root.bind("<F4>", self.toggle_right_to_left)
+        self.root.bind("<F3>", self.next_search_hit)
+        self.root.bind("<Shift-F3>", self.prev_search_hit)
+        self.root.bind("<Control-f>", lambda event: self.search_entry.focus_set())
         self.root.bind("<Escape>", self.exit_fullscreen)
         self.root.bind("<Up>", self.scroll_up)
         self.root.bind("<Down>", self.scroll_down)
         self.fullscreen = False
 
-        # Check command line arguments for file to open
-        if hasattr(sys, 'frozen'):
-            # Running as a bundled executable
-            if len(sys.argv) > 1:
-                file_path = sys.argv[1]
-                if file_path.lower().endswith('.pdf'):
-                    self.open_pdf(file_path)
-                elif file_path.lower().endswith('.cbz'):
-                    self.open_cbz(file_path)
-        else:
-            # Running as a script
-            if len(sys.argv) > 1:
-                file_path = sys.argv[1]
-                if file_path.lower().endswith('.pdf'):
-                    self.open_pdf(file_path)
-                elif file_path.lower().endswith('.cbz'):
-                    self.open_cbz(file_path)
+        # Check command line arguments for file to open, the same whether bundled or running as a script
+        if len(sys.argv) > 1:
+            self.open_path(sys.argv[1])
 
     def scroll_up(self, event):
         self.canvas.yview_scroll(-1, "units")
@@ -200,6 +1884,28 @@ class PDFViewer:
         self.resize_elements()
         return "break"
 
+    def toggle_perf_overlay(self, event=None):
+        self.perf_overlay = not self.perf_overlay
+        self.update_perf_overlay()
+        return "break"
+
+    def update_perf_overlay(self):
+        # Redraws the timing overlay in the top left corner of the visible canvas area
+        self.canvas.delete("perf_overlay")
+        if not self.perf_overlay:
+            return
+        lines = ["stage          last ms    avg ms"]
+        for name, last, average, _ in perf.summary():
+            lines.append(f"{name:<14}{last:>8.1f}{average:>10.1f}")
+        stats = self.frames.stats()
+        lines.append(f"frames {stats['entries']} / {stats['bytes'] / 2 ** 20:.0f} MB")
+        lines.append(f"hits {stats['hits']}  misses {stats['misses']}  evictions {stats['evictions']}")
+        x, y = self.canvas.canvasx(0) + 8, self.canvas.canvasy(0) + 8
+        text = self.canvas.create_text(x + 6, y + 6, anchor=tk.NW, text="\n".join(lines), fill='#9fe29f', font=('Courier', 9), tags="perf_overlay")
+        x0, y0, x1, y1 = self.canvas.bbox(text)
+        background = self.canvas.create_rectangle(x0 - 6, y0 - 6, x1 + 6, y1 + 6, fill='#000000', outline='#4e4e4e', tags="perf_overlay")
+        self.canvas.tag_lower(background, text)
+
     def exit_fullscreen(self, event=None):
         if self.fullscreen:
             self.fullscreen = False
@@ -215,6 +1921,369 @@ class PDFViewer:
         self.top_section.pack(side=tk.TOP, fill=tk.X, pady=5)
         self.music_frame.pack(side=tk.BOTTOM, fill=tk.X, pady=5)
 
+    def toggle_thumbnails(self, event=None):
+        self.thumbnails_var.set(not self.thumbnails_var.get())
+        self.apply_thumbnails()
+        return "break"
+
+    def apply_thumbnails(self):
+        if self.thumbnails_var.get():
+            self.thumbnail_sidebar.show(before=self.canvas)
+        else:
+            self.thumbnail_sidebar.hide()
+
+    def toggle_continuous(self, event=None):
+        self.continuous_var.set(not self.continuous_var.get())
+        self.apply_continuous()
+        return "break"
+
+    def apply_continuous(self):
+        self.continuous = self.continuous_var.get()
+        self.continuous_layout = None
+        self.render_pipeline.cancel(group='page')
+        self.show_page(self.current_page)
+
+    def toggle_auto_crop(self, event=None):
+        self.auto_crop_var.set(not self.auto_crop_var.get())
+        self.apply_auto_crop()
+        return "break"
+
+    def apply_auto_crop(self):
+        self.auto_crop = self.auto_crop_var.get()
+        if self.document:
+            if self.auto_crop:
+                self.queue_page_analysis()
+            if self.fit_mode:
+                self.apply_fit()
+            self.show_page(self.current_page)
+
+    def toggle_panel_view(self, event=None):
+        self.panel_view_var.set(not self.panel_view_var.get())
+        self.apply_panel_view()
+        return "break"
+
+    def apply_panel_view(self):
+        self.panel_view = self.panel_view_var.get()
+        if self.document:
+            if self.panel_view:
+                self.queue_page_analysis()
+            self.show_page(self.current_page, panel=0)
+
+    def toggle_spreads(self, event=None):
+        self.spread_var.set(not self.spread_var.get())
+        self.apply_spreads()
+        return "break"
+
+    def apply_spreads(self):
+        self.spread_mode = self.spread_var.get()
+        self.render_pipeline.cancel(group='page')
+        if self.document:
+            if self.fit_mode:
+                self.apply_fit()
+            self.show_page(self.current_page)
+
+    def toggle_right_to_left(self, event=None):
+        self.right_to_left_var.set(not self.right_to_left_var.get())
+        self.apply_right_to_left()
+        return "break"
+
+    def apply_right_to_left(self):
+        self.right_to_left = self.right_to_left_var.get()
+        if self.document and self.showing_spreads():
+            self.render_pipeline.cancel(group='page')
+            self.show_page(self.current_page)
+
+    def showing_spreads(self):
+        # Continuous mode scrolls through single pages
+        return self.spread_mode and not self.continuous
+
+    def single_pages(self):
+        # Whether pages are shown one at a time, the view auto crop and guided panels work in
+        return not self.continuous and not self.spread_mode
+
+    def page_spreads(self):
+        if self.spread_table is None:
+            # Page sizes are cheap to get, so the whole document is paired without rendering anything
+            spreads = pair_spreads([self.document.page_size(page) for page in range(len(self.document))])
+            self.spread_table = (spreads, [index for index, spread in enumerate(spreads) for _ in spread])
+        return self.spread_table
+
+    def view_pages(self, page_number):
+        # The pages shown together with page_number, in reading order
+        if not self.showing_spreads():
+            return (page_number,)
+        spreads, spread_index = self.page_spreads()
+        return spreads[spread_index[page_number]]
+
+    def spread_pages(self, page_number):
+        # The pages of page_number's spread left to right, None when it is shown alone
+        pages = self.view_pages(page_number)
+        if len(pages) < 2:
+            return None
+        return pages[::-1] if self.right_to_left else pages
+
+    def view_step(self, page_number, step):
+        # First page of the view step views away, None past either end of the document
+        if not self.showing_spreads():
+            page = page_number + step
+            return page if 0 <= page < len(self.document) else None
+        spreads, spread_index = self.page_spreads()
+        index = spread_index[page_number] + step
+        return spreads[index][0] if 0 <= index < len(spreads) else None
+
+    def view_size(self, page_number):
+        pages = self.spread_pages(page_number)
+        if pages:
+            return spread_layout(self.document, pages)[1]
+        return self.document.page_size(page_number)
+
+    def view_origins(self, page_number, x, y, zoom):
+        # Where each page of the view drawn at (x, y) is, for placing search hits
+        pages = self.spread_pages(page_number)
+        if not pages:
+            return [(page_number, x, y, zoom)]
+        placed, _ = spread_layout(self.document, pages)
+        return [(page, x + offset * zoom, y, zoom * scale) for page, offset, scale in placed]
+
+    def view_renderer(self, page_number):
+        # Renders what is shown for page_number, the composite in spread mode. Safe to call from the workers
+        document = self.document
+        pages = self.spread_pages(page_number)
+        if pages:
+            return lambda zoom, clip=None, preview=False: render_spread(document, pages, zoom, clip, preview)
+        return lambda zoom, clip=None, preview=False: (document.render_preview(page_number, zoom) if preview
+                                                         else document.render(page_number, zoom, clip))
+
+    def queue_page_analysis(self):
+        # What the enabled modes need for the rest of the document, found in the background
+        for page in range(len(self.document)):
+            self.request_page_analysis(page, CROP_PRIORITY)
+
+    def request_page_analysis(self, page_number, priority):
+        if self.auto_crop and page_number not in self.crop_boxes:
+            self.request_analysis('crop', page_number, priority, content_box, CROP_SAMPLE_PIXELS)
+        if self.panel_view and page_number not in self.panels:
+            self.request_analysis('panels', page_number, priority, find_panels, PANEL_SAMPLE_PIXELS)
+
+    def page_analysed(self, page_number):
+        return ((not self.auto_crop or page_number in self.crop_boxes) and
+                (not self.panel_view or page_number in self.panels))
+
+    def request_analysis(self, kind, page_number, priority, detect, pixels):
+        # Content boxes and panels are found on a small render, a few milliseconds per page
+        document = self.document
+        width, height = document.page_size(page_number)
+        zoom = min((pixels / (width * height)) ** 0.5, 1.0)
+        key = (kind, document.identity, page_number)
+        self.render_pipeline.submit(key, lambda: detect(document.render_preview(page_number, zoom)), self.on_page_analysed,
+                                    priority, group='analysis')
+        self.schedule_render_drain()
+
+    def on_page_analysed(self, key, result, error):
+        kind, identity, page = key
+        if not self.document or identity != self.document.identity:
+            return
+        (self.crop_boxes if kind == 'crop' else self.panels)[page] = result if error is None else None
+        self.schedule_library_save()
+        if self.page_wait and self.page_wait[0] == page:
+            if self.page_analysed(page):
+                _, reset_view, panel = self.page_wait
+                self.show_page(page, reset_view, panel)
+        elif not self.continuous and abs(page - self.current_page) <= max(PREFETCH_AHEAD, PREFETCH_BEHIND):
+            # Now at the zoom that fits its content or panels
+            self.prefetch_around(self.current_page, self.shown_key[2] if self.shown_key else quantize_zoom(self.zoom_level))
+
+    def crop_box(self, page_number):
+        return self.crop_boxes.get(page_number) if self.auto_crop and self.single_pages() else None
+
+    def page_panels(self, page_number):
+        return self.panels.get(page_number) if self.panel_view and self.single_pages() else None
+
+    def page_zoom(self, page_number, zoom):
+        # Pages in guided view are rendered for their panels, fitted auto-cropped pages for their content
+        # and fitted spreads for their width, which differs between paired and single pages
+        if self.page_panels(page_number):
+            return self.panel_render_zoom(page_number)
+        if self.fit_mode and (self.showing_spreads() or self.crop_box(page_number)):
+            return quantize_zoom(self.fit_zoom(page_number))
+        return zoom
+
+    def panel_render_zoom(self, page_number):
+        # One render of the page that's sharp enough for its most zoomed in panel, every panel is cut from it
+        width, height = self.document.page_size(page_number)
+        canvas_width, canvas_height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        zoom = max(min(canvas_width / (width * (x1 - x0)), canvas_height / (height * (y1 - y0)))
+                   for x0, y0, x1, y1 in self.panels[page_number])
+        zoom = min(zoom, (TILED_RENDER_PIXELS / (width * height)) ** 0.5)
+        if isinstance(self.document, CBZPageSource):
+            zoom = min(zoom, 1.0)  # Scans have nothing more to show beyond their own resolution
+        return quantize_zoom(zoom)
+
+    def panel_cut_size(self, img, box):
+        x0, y0, x1, y1 = box
+        scale = min(self.canvas.winfo_width() / ((x1 - x0) * img.width), self.canvas.winfo_height() / ((y1 - y0) * img.height))
+        return (max(int((x1 - x0) * img.width * scale), 1), max(int((y1 - y0) * img.height * scale), 1))
+
+    @staticmethod
+    def cut_panel(img, box, size, quality):
+        x0, y0, x1, y1 = box
+        return scale_image(img, size, quality, box=(x0 * img.width, y0 * img.height, x1 * img.width, y1 * img.height))
+
+    def display_panel(self, img, panels):
+        # Cuts the current panel out of the page render and fits it to the canvas, without rendering anything.
+        # Panels cut ahead at full quality are used when there are any, otherwise a quick cut is made
+        self.panel_index = min(self.panel_index, len(panels) - 1)
+        box = panels[self.panel_index]
+        size = self.panel_cut_size(img, box)
+        cuts = self.panel_cuts
+        if cuts and cuts[0] == self.shown_key and cuts[1][self.panel_index].size == size:
+            panel = cuts[1][self.panel_index]
+        else:
+            with perf.stage('panel', f"page {self.current_page + 1} panel {self.panel_index + 1}"):
+                panel = self.cut_panel(img, box, size, QUALITY_INTERACTIVE)
+        self.display_frame(panel, reset_view=True, whole_page=False)
+
+    def request_panel_cuts(self, key, img, panels):
+        # Cuts every panel of the page at full quality on a worker, the next steps only hand an image to Tk
+        sizes = [self.panel_cut_size(img, box) for box in panels]
+        self.render_pipeline.submit(key + ('panels',), lambda: [self.cut_panel(img, box, size, QUALITY_FINAL) for box, size in zip(panels, sizes)],
+                                    self.on_panels_cut, priority=0, group='panels')
+        self.schedule_render_drain()
+
+    def on_panels_cut(self, key, cuts, error):
+        key = key[:-1]
+        if error is None and key == self.shown_key:
+            self.panel_cuts = (key, cuts)
+            panels = self.page_panels(key[1])
+            frame = self.frames.get(key)
+            if panels and frame is not None:
+                self.display_panel(frame, panels)  # Sharper than the quick cut on screen
+
+    def step_panel(self, step):
+        # Moves between the panels of the page on screen, False past either end of the page
+        # Checked against the panel page rather than shown_key, which a pending zoom render clears
+        panels = self.page_panels(self.current_page)
+        if not panels or self.panel_page != self.current_page:
+            return False
+        index = self.panel_index + step
+        if not 0 <= index < len(panels):
+            return False
+        self.panel_index = index
+        key = self.frame_key(self.current_page, self.panel_render_zoom(self.current_page))
+        frame = self.frames.get(key)
+        if frame is not None:
+            self.shown_key = key
+            self.display_panel(frame, panels)
+        else:
+            self.show_page(self.current_page)
+        return True
+
+    def continuous_zoom_limit(self):
+        # Continuous mode renders every page whole, so it stops zooming in where the largest page
+        # would have to be tiled, which keeps each rendered page within the frame cache's budget
+        largest = max(width * height for width, height in map(self.document.page_size, range(len(self.document))))
+        return int((TILED_RENDER_PIXELS / largest) ** 0.5 / ZOOM_QUANTUM) * ZOOM_QUANTUM  # Rounded down, quantizing can't go past it
+
+    def layout_continuous(self, zoom):
+        # Page sizes are cheap to get, so the whole document is laid out without rendering anything
+        sizes = [self.document.page_size(page) for page in range(len(self.document))]
+        widths = [int(width * zoom) for width, _ in sizes]
+        content_width = max(max(widths), self.canvas.winfo_width())
+        tops, heights = [], []
+        y = CONTINUOUS_PAGE_GAP
+        for _, height in sizes:
+            tops.append(y)
+            heights.append(int(height * zoom))
+            y += heights[-1] + CONTINUOUS_PAGE_GAP
+        lefts = [(content_width - width) // 2 for width in widths]
+        return {'key': self.continuous_key(zoom), 'zoom': zoom, 'tops': tops, 'heights': heights,
+                'lefts': lefts, 'widths': widths, 'width': content_width, 'height': y}
+
+    def continuous_key(self, zoom):
+        # The layout depends on the canvas width because narrower pages are centered
+        return (self.document.identity, zoom, self.canvas.winfo_width())
+
+    def show_continuous(self, page_number, zoom, reset_view):
+        # Remember where in the current page the view is, so zooming keeps the reader's place
+        offset = 0.0
+        layout = self.continuous_layout
+        if layout and not reset_view:
+            top = self.canvas.canvasy(0)
+            offset = (top - layout['tops'][self.current_page]) / max(layout['heights'][self.current_page], 1)
+
+        if not layout or layout['key'] != self.continuous_key(zoom):
+            self.canvas.delete("all")
+            self.photo = None
+            self.tiled_view = None
+            self.tile_items = {}
+            self.page_origins = []
+            self.zoom_base = None
+            self.continuous_items = {}
+            self.continuous_pool = []
+            layout = self.continuous_layout = self.layout_continuous(zoom)
+            self.canvas.config(scrollregion=(0, 0, layout['width'], layout['height']))
+
+        target = layout['tops'][page_number] + offset * layout['heights'][page_number] - (0 if offset else CONTINUOUS_PAGE_GAP)
+        self.canvas.yview_moveto(max(target, 0) / layout['height'])
+        self.update_continuous()
+
+    def update_continuous(self):
+        layout = self.continuous_layout
+        view_top = self.canvas.canvasy(0)
+        view_height = self.canvas.winfo_height()
+
+        # Track the page under the upper part of the viewport as the current one
+        current = max(bisect.bisect_right(layout['tops'], view_top + view_height / 3) - 1, 0)
+        if current != self.current_page:
+            self.current_page = current
+            self.root.title(f"{self.document.kind} Viewer - Page {current + 1}/{len(self.document)}")
+            self.thumbnail_sidebar.highlight(current)
+            self.schedule_library_save()
+
+        # Pages within one screen of the viewport stay on the canvas, everything else is recycled
+        first = max(bisect.bisect_right(layout['tops'], view_top - view_height) - 1, 0)
+        last = min(bisect.bisect_right(layout['tops'], view_top + 2 * view_height), len(self.document)) - 1
+        wanted = range(first, last + 1)
+        for page in list(self.continuous_items):
+            if page not in wanted:
+                self.recycle_continuous_item(page)
+
+        zoom = layout['zoom']
+        keys = {self.frame_key(page, zoom) for page in wanted}
+        self.render_pipeline.cancel(lambda key: key not in keys, group='page')
+        for page in sorted(wanted, key=lambda page: abs(page - current)):
+            if page in self.continuous_items:
+                continue
+            frame = self.frames.get(self.frame_key(page, zoom))
+            self.place_continuous_page(page, frame)
+            if frame is None:
+                self.request_frame(page, zoom, priority=abs(page - current))
+
+    def place_continuous_page(self, page, frame):
+        layout = self.continuous_layout
+        x, y = layout['lefts'][page], layout['tops'][page]
+        if self.continuous_pool:
+            placeholder, image = self.continuous_pool.pop()
+        else:
+            placeholder = self.canvas.create_rectangle(0, 0, 0, 0, fill='#3a3a3a', outline='')
+            image = self.canvas.create_image(0, 0, anchor=tk.NW)
+        self.canvas.coords(placeholder, x, y, x + layout['widths'][page], y + layout['heights'][page])
+        self.canvas.coords(image, x, y)
+        with perf.stage('photoimage'):
+            photo = ImageTk.PhotoImage(frame) if frame is not None else None
+        self.canvas.itemconfig(placeholder, state=tk.HIDDEN if photo else tk.NORMAL)
+        self.canvas.itemconfig(image, image=photo or '', state=tk.NORMAL if photo else tk.HIDDEN)
+        self.continuous_items[page] = (placeholder, image, photo)
+        self.canvas.delete(f"search_hit_{page}")
+        self.draw_search_hits(page, x, y, layout['zoom'])
+
+    def recycle_continuous_item(self, page):
+        placeholder, image, _ = self.continuous_items.pop(page)
+        self.canvas.delete(f"search_hit_{page}")
+        self.canvas.itemconfig(placeholder, state=tk.HIDDEN)
+        self.canvas.itemconfig(image, image='', state=tk.HIDDEN)
+        self.continuous_pool.append((placeholder, image))
+
     def toggle_comic_mode(self):
         self.comic_mode = not self.comic_mode
         if self.comic_mode:
@@ -223,14 +2292,18 @@ class PDFViewer:
         else:
             # Restore music player controls
             self.music_frame.pack(side=tk.BOTTOM, fill=tk.X, pady=5)
+        self.update_music_progress()  # Stops the progress updates while hidden, resumes them when shown again
 
     def open_file(self):
         file_path = filedialog.askopenfilename(filetypes=[("PDF files", "*.pdf"), ("Comic Book Zip files", "*.cbz")])
         if file_path:
-            if file_path.lower().endswith('.pdf'):
-                self.open_pdf(file_path)
-            elif file_path.lower().endswith('.cbz'):
-                self.open_cbz(file_path)
+            self.open_path(file_path)
+
+    def open_path(self, file_path):
+        if file_path.lower().endswith('.pdf'):
+            self.open_pdf(file_path)
+        elif file_path.lower().endswith('.cbz'):
+            self.open_cbz(file_path)
 
     def resize_window(self, width, height):
         screen_width = self.root.winfo_screenwidth()
@@ -241,86 +2314,417 @@ class PDFViewer:
 
     def open_pdf(self, file_path):
         try:
-            self.pdf_document = fitz.open(file_path)
-            self.current_page = 0
-            self.zoom_level = 1.0
+            entry = self.library.lookup(file_path)
+            self.set_document(PDFPageSource(file_path, sizes=entry and entry['sizes'], render_processes=self.render_processes))
+            self.restore_position(entry)
+            # Resize window based on the first page size, taken from the page rectangle rather than a render
+            width, height = self.document.page_size(0)
+            self.resize_window(int(width), int(height))
             self.show_page(self.current_page)
-            # Resize window based on the first page size
-            page = self.pdf_document[0]
-            pix = page.get_pixmap()
-            self.resize_window(pix.width, pix.height)
+            self.save_reading_position()
+            if self.auto_crop or self.panel_view:
+                self.queue_page_analysis()
+            self.search_index.index(self.document)  # Text is extracted in the background while reading
+            self.poll_search_index()
         except Exception as e:
             messagebox.showerror("Error", f"Failed to open PDF: {e}")
-            self.pdf_document = None
+            self.set_document(None)
 
     def open_cbz(self, file_path):
         try:
-            with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                image_files = [f for f in zip_ref.namelist() if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-                image_files.sort()  # Sort files to display in order
-                self.cbz_images = [Image.open(zip_ref.open(f)) for f in image_files]
-                self.current_page = 0
-                self.zoom_level = 1.0
-                self.show_image(self.current_page)
-                # Resize window based on the first image size
-                img = self.cbz_images[0]
-                self.resize_window(img.width, img.height)
+            entry = self.library.lookup(file_path)
+            self.set_document(CBZPageSource(file_path, names=entry and entry['names'], sizes=entry and entry['sizes']))
+            self.restore_position(entry)
+            # Resize window based on the first image size, read from the image header
+            width, height = self.document.page_size(0)
+            self.resize_window(width, height)
+            self.show_page(self.current_page)
+            self.save_reading_position()
+            if self.auto_crop or self.panel_view:
+                self.queue_page_analysis()
         except Exception as e:
             messagebox.showerror("Error", f"Failed to open CBZ file: {e}")
-            self.cbz_images = []
-
-    def show_page(self, page_number):
-        if self.pdf_document and 0 <= page_number < len(self.pdf_document):
-            try:
-                page = self.pdf_document[page_number]
-                matrix = fitz.Matrix(self.zoom_level, self.zoom_level)
-                pix = page.get_pixmap(matrix=matrix, alpha=False)  # Ensure alpha is set to False
-                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                
-                self.photo = ImageTk.PhotoImage(img)
-                self.canvas.delete("all")
-
-                # Calculate centered coordinates
-                canvas_width = self.canvas.winfo_width()
-                canvas_height = self.canvas.winfo_height()
-                img_width, img_height = img.size
-
-                x = max((canvas_width - img_width) // 2, 0)
-                y = max((canvas_height - img_height) // 2, 0)
-
-                self.canvas.create_image(x, y, anchor=tk.NW, image=self.photo)
-
-                # Update scroll region and reset view to top
-                self.canvas.config(scrollregion=self.canvas.bbox(tk.ALL))
+            self.set_document(None)
+
+    def set_document(self, document):
+        # Drop everything rendered for the previous document before switching
+        self.render_pipeline.cancel()
+        if self.document:
+            self.save_reading_position()
+            self.document.close()
+        self.document = document
+        self.current_page = 0
+        self.zoom_level = 1.0
+        self.fit_mode = None  # Goes with the zoom, a known document restores both
+        self.continuous_layout = None
+        self.spread_table = None
+        self.thumbnail_sidebar.set_document(document)
+        self.search_index.index(None)
+        self.search_query = None
+        self.search_pages = []
+        self.search_rects = {}
+        self.index_progress = None
+        self.search_label.config(text="")
+        self.crop_boxes = {}
+        self.panels = {}
+        self.panel_page = None
+        self.page_wait = None
+
+    def restore_position(self, entry):
+        # Picks up where the reader left a known document
+        if entry:
+            self.crop_boxes = entry['crops']
+            self.panels = entry['panels']
+            self.current_page = min(max(entry['last_page'] or 0, 0), len(self.document) - 1)
+            self.fit_mode = entry['fit_mode']
+            if self.fit_mode:
+                self.apply_fit()
+            else:
+                self.zoom_level = clamp_zoom(entry['zoom'] or 1.0)
+
+    def save_reading_position(self):
+        if self.library_save_id is not None:
+            self.root.after_cancel(self.library_save_id)
+            self.library_save_id = None
+        if self.document:
+            self.library.save(self.document, self.current_page, self.zoom_level, self.fit_mode, self.crop_boxes, self.panels)
+
+    def schedule_library_save(self):
+        # Coalesces page turns, only the page the reader settles on is written
+        if self.library_save_id is not None:
+            self.root.after_cancel(self.library_save_id)
+        self.library_save_id = self.root.after(LIBRARY_SAVE_MS, self.save_reading_position)
+
+    def update_recent_menu(self):
+        self.recent_menu.delete(0, tk.END)
+        recent = self.library.recent()
+        for path, pages, last_page in recent:
+            self.recent_menu.add_command(label=f"{os.path.basename(path)}  ({last_page + 1}/{pages})",
+                                         command=lambda path=path: self.open_path(path))
+        if not recent:
+            self.recent_menu.add_command(label="No recent files", state=tk.DISABLED)
+
+    def frame_key(self, page_number, zoom):
+        # Spreads are keyed by their first page plus their pages left to right, so both orders can be cached
+        pages = self.spread_pages(page_number)
+        key = (self.document.identity, page_number, zoom)
+        return key + (pages,) if pages else key
+
+    def show_page(self, page_number, reset_view=True, panel=None):
+        # panel is the panel to start at in guided view, -1 for the last one, None to stay on the current one
+        if self.document and 0 <= page_number < len(self.document):
+            self.page_wait = None
+            page_number = self.current_page = self.view_pages(page_number)[0]  # Spreads are shown from their first page
+            if self.single_pages() and not self.page_analysed(page_number):
+                # The content box and panels decide the zoom and what is shown first, so the page waits the few ms they take
+                self.page_wait = (page_number, reset_view, panel)
+                self.request_page_analysis(page_number, priority=-2)
+                return
+            panels = self.page_panels(page_number)
+            if panel is not None or page_number != self.panel_page:
+                self.panel_page = page_number
+                self.panel_index = (panel or 0) % len(panels) if panels else 0
+            if panels:
+                zoom = self.panel_render_zoom(page_number)
+            else:
+                if self.fit_mode and (self.showing_spreads() or self.crop_box(page_number)):
+                    self.zoom_level = self.fit_zoom(page_number)
+                if self.continuous:
+                    self.zoom_level = min(self.zoom_level, self.continuous_zoom_limit())
+                zoom = quantize_zoom(self.zoom_level)
+            key = self.frame_key(page_number, zoom)
+            self.shown_key = key
+            self.reset_view_pending = reset_view
+            self.page_requested_at = time.perf_counter()
+            if self.zoom_render_id is not None:
+                self.root.after_cancel(self.zoom_render_id)
+                self.zoom_render_id = None
+            pages = self.view_pages(page_number)
+            shown = f"{pages[0] + 1}-{pages[-1] + 1}" if len(pages) > 1 else f"{page_number + 1}"
+            self.root.title(f"{self.document.kind} Viewer - Page {shown}/{len(self.document)}")
+            self.thumbnail_sidebar.highlight(page_number)
+            self.schedule_library_save()
+            if self.continuous:
+                self.show_continuous(page_number, zoom, reset_view)
+                return
+            if self.needs_tiles(page_number, zoom):
+                self.prefetch_around(page_number, zoom)
+                self.show_tiled(page_number, zoom)
+                return
+            frame = self.frames.get(key)
+            if frame is not None:
+                self.prefetch_around(page_number, zoom)
+                self.present_frame(frame)
+                if panels and not (self.panel_cuts and self.panel_cuts[0] == key):
+                    self.request_panel_cuts(key, frame, panels)
+            else:
+                # Nothing else is rendered until this page is on screen, neighbours are prefetched once its frame
+                # arrives, and the full render only starts once the preview is shown, so neither holds the other up
+                self.render_pipeline.cancel(group='page')
+                if self.wants_preview(page_number, zoom):
+                    self.request_preview(page_number, zoom)
+                else:
+                    self.request_frame(page_number, zoom, priority=0)
+
+    def request_frame(self, page_number, zoom, priority):
+        render = self.view_renderer(page_number)
+        key = self.frame_key(page_number, zoom)
+        self.render_pipeline.submit(key, lambda: render(zoom), self.on_frame_rendered, priority)
+        self.schedule_render_drain()
+
+    def wants_preview(self, page_number, zoom):
+        # Small pages render fast enough that a preview would only add work
+        width, height = self.view_size(page_number)
+        return width * zoom * height * zoom > 4 * PREVIEW_PIXELS
+
+    def request_preview(self, page_number, zoom):
+        render = self.view_renderer(page_number)
+        key = self.frame_key(page_number, zoom) + ('preview',)
+        self.render_pipeline.submit(key, lambda: render(zoom, preview=True), self.on_preview_rendered, priority=-1)
+        self.schedule_render_drain()
+
+    def on_preview_rendered(self, key, preview, error):
+        # Only useful while the full render of the same page hasn't arrived yet, which is requested from here
+        key = key[:-1]
+        if key == self.shown_key and key not in self.frames:
+            if error is None:
+                self.present_frame(preview)
+            self.request_frame(key[1], key[2], priority=0)
+
+    def prefetch_around(self, page_number, zoom):
+        # Render the pages the reader is most likely to turn to next, nearest first. In spread mode
+        # these are whole spreads, so turning to one is the same cache hit as turning to a single page
+        wanted = [page_number]
+        ahead = behind = page_number
+        for distance in range(1, max(PREFETCH_AHEAD, PREFETCH_BEHIND) + 1):
+            if distance <= PREFETCH_AHEAD and ahead is not None:
+                ahead = self.view_step(ahead, 1)
+                if ahead is not None:
+                    wanted.append(ahead)
+            if distance <= PREFETCH_BEHIND and behind is not None:
+                behind = self.view_step(behind, -1)
+                if behind is not None:
+                    wanted.append(behind)
+        if (self.auto_crop or self.panel_view) and self.single_pages():
+            # Neighbours are only rendered once their content box and panels, and so their zoom, are known
+            for page in wanted:
+                self.request_page_analysis(page, priority=-1)
+            wanted = [page for page in wanted if page == page_number or self.page_analysed(page)]
+        zooms = {page: zoom if page == page_number else self.page_zoom(page, zoom) for page in wanted}
+        # Pages that will be shown as tiles are never rendered whole
+        wanted = [page for page in wanted if not self.needs_tiles(page, zooms[page])]
+        keys = {self.frame_key(page, zooms[page]) for page in wanted}
+        keys.add(self.frame_key(page_number, zoom) + ('preview',))  # Its callback requests the page's full render
+
+        # Cancel queued jobs for pages or zoom levels we no longer care about
+        self.render_pipeline.cancel(lambda key: key not in keys, group='page')
+
+        for priority, page in enumerate(wanted, start=1):
+            if page != page_number and self.frame_key(page, zooms[page]) not in self.frames:
+                self.request_frame(page, zooms[page], priority)
+
+    def needs_tiles(self, page_number, zoom):
+        width, height = self.view_size(page_number)
+        return width * zoom * height * zoom > TILED_RENDER_PIXELS
+
+    def show_tiled(self, page_number, zoom):
+        # Lay out the full page size but only render the tiles that intersect the viewport
+        key = self.frame_key(page_number, zoom)
+        width, height = self.view_size(page_number)
+        width, height = int(width * zoom), int(height * zoom)
+        x = max((self.canvas.winfo_width() - width) // 2, 0)
+        y = max((self.canvas.winfo_height() - height) // 2, 0)
+
+        self.canvas.delete("all")
+        self.photo = None
+        self.tile_items = {}
+        self.continuous_layout = None
+        self.tiled_view = (key, page_number, zoom, x, y, width, height)
+        self.page_origins = self.view_origins(page_number, x, y, zoom)
+        for origin in self.page_origins:
+            self.draw_search_hits(*origin)
+        self.keep_view(lambda: self.canvas.config(scrollregion=(x, y, x + width, y + height)), self.reset_view_pending)
+        self.reset_view_pending = False
+        self.zoom_base = None
+        self.update_tiles()
+
+    def update_tiles(self):
+        key, page_number, zoom, x, y, width, height = self.tiled_view
+        left = self.canvas.canvasx(0) - x - TILE_MARGIN
+        top = self.canvas.canvasy(0) - y - TILE_MARGIN
+        right = left + self.canvas.winfo_width() + 2 * TILE_MARGIN
+        bottom = top + self.canvas.winfo_height() + 2 * TILE_MARGIN
+
+        columns = range(max(int(left) // TILE_SIZE, 0), min(int(right) // TILE_SIZE, (width - 1) // TILE_SIZE) + 1)
+        rows = range(max(int(top) // TILE_SIZE, 0), min(int(bottom) // TILE_SIZE, (height - 1) // TILE_SIZE) + 1)
+        wanted = {(column, row) for column in columns for row in rows}
+
+        # Recycle tiles that have scrolled out of range and drop their queued renders
+        for tile in list(self.tile_items):
+            if tile not in wanted:
+                self.canvas.delete(self.tile_items.pop(tile)[0])
+        wanted_keys = {key + ('tile',) + tile for tile in wanted}
+        self.render_pipeline.cancel(lambda job_key: job_key[:len(key)] == key and job_key not in wanted_keys, group='page')
+
+        # Request tiles nearest the middle of the viewport first
+        render = self.view_renderer(page_number)
+        center = ((left + right) / 2, (top + bottom) / 2)
+        for column, row in sorted(wanted, key=lambda tile: abs((tile[0] + 0.5) * TILE_SIZE - center[0]) + abs((tile[1] + 0.5) * TILE_SIZE - center[1])):
+            if (column, row) in self.tile_items:
+                continue
+            tile_key = key + ('tile', column, row)
+            tile = self.frames.get(tile_key)
+            if tile is not None:
+                self.place_tile(column, row, tile)
+            else:
+                clip = (column * TILE_SIZE, row * TILE_SIZE, min((column + 1) * TILE_SIZE, width), min((row + 1) * TILE_SIZE, height))
+                self.render_pipeline.submit(tile_key, lambda clip=clip: render(zoom, clip), self.on_tile_rendered)
+        self.schedule_render_drain()
+
+    def place_tile(self, column, row, tile):
+        _, _, _, x, y, _, _ = self.tiled_view
+        with perf.stage('photoimage'):
+            photo = ImageTk.PhotoImage(tile)
+        item = self.canvas.create_image(x + column * TILE_SIZE, y + row * TILE_SIZE, anchor=tk.NW, image=photo)
+        self.tile_items[(column, row)] = (item, photo)
+        self.canvas.tag_raise("search_hit")
+
+    def on_tile_rendered(self, key, tile, error):
+        if error is not None or not self.document or key[0] != self.document.identity:
+            return
+        self.frames.put(key, tile)
+        column, row = key[-2:]
+        if self.tiled_view and key[:-3] == self.tiled_view[0] and (column, row) not in self.tile_items:
+            self.place_tile(column, row, tile)
+
+    def on_canvas_yscroll(self, first, last):
+        self.v_scroll.set(first, last)
+        self.schedule_viewport_update()
+
+    def on_canvas_xscroll(self, first, last):
+        self.h_scroll.set(first, last)
+        self.schedule_viewport_update()
+
+    def schedule_viewport_update(self):
+        if self.viewport_update_id is None:
+            self.viewport_update_id = self.root.after_idle(self.update_viewport)
+
+    def update_viewport(self):
+        # Called once the canvas has been scrolled or resized
+        self.viewport_update_id = None
+        self.update_perf_overlay()
+        if self.continuous and self.continuous_layout:
+            if self.continuous_layout['key'] != self.continuous_key(self.continuous_layout['zoom']):
+                self.show_page(self.current_page, reset_view=False)
+            else:
+                self.update_continuous()
+        elif self.tiled_view:
+            self.update_tiles()
+
+    def on_frame_rendered(self, key, frame, error):
+        if not self.document or key[0] != self.document.identity:
+            return  # Rendered for a document that has since been closed
+        if error is not None:
+            if key == self.shown_key:
+                messagebox.showerror("Error", f"Failed to render page: {error}")
+            return
+        self.frames.put(key, frame)
+        if self.continuous:
+            page = key[1]
+            if self.continuous_layout and key[2] == self.continuous_layout['zoom'] and page in self.continuous_items:
+                self.recycle_continuous_item(page)
+                self.place_continuous_page(page, frame)
+        elif key == self.shown_key:
+            self.present_frame(frame)
+            self.prefetch_around(key[1], key[2])
+            panels = self.page_panels(key[1])
+            if panels:
+                self.request_panel_cuts(key, frame, panels)
+
+    def schedule_render_drain(self):
+        if self.render_drain_id is None:
+            self.render_drain_id = self.root.after(RENDER_POLL_MS, self.drain_render_results)
+
+    def drain_render_results(self):
+        # Finished frames are handed over here so that all Tk calls stay on the Tk thread
+        self.render_drain_id = None
+        self.render_pipeline.drain()
+        if self.render_pipeline.busy:
+            self.schedule_render_drain()
+        self.update_perf_overlay()
+
+    def present_frame(self, img):
+        # Draws a render of shown_key, only the first one drawn for it may reset the scroll position,
+        # so a sharp render replacing its preview leaves the view where the reader put it
+        panels = self.page_panels(self.shown_key[1])
+        if panels:
+            self.display_panel(img, panels)
+        else:
+            self.display_frame(img, reset_view=self.reset_view_pending)
+        self.reset_view_pending = False
+        self.zoom_base = None if panels else (img, self.shown_key[2])
+        if self.render_processes is None and isinstance(self.document, PDFPageSource):
+            # Started only now, so starting them doesn't compete with the first page, and then kept for every later PDF
+            self.render_processes = self.document.render_processes = RenderProcesses()
+        if not self.first_page_shown:
+            self.first_page_shown = True
+            perf.record('first_page', time.perf_counter() - STARTUP_TIME, f"page {self.shown_key[1] + 1}")
+        if self.page_requested_at is not None:
+            # Time from the page being asked for until something was on screen for it
+            perf.record('page_ready', time.perf_counter() - self.page_requested_at, f"page {self.shown_key[1] + 1}")
+            self.page_requested_at = None
+
+    def keep_view(self, change, reset_view):
+        # Applies a change to the scroll region while keeping the same relative scroll position
+        x_fraction, y_fraction = self.canvas.xview()[0], self.canvas.yview()[0]
+        change()
+        if reset_view:
+            box = self.crop_box(self.current_page)
+            if box:
+                # Start at the content's top left corner, the scroll region is the page so the fractions carry over
+                self.canvas.xview_moveto(box[0])
+                self.canvas.yview_moveto(box[1])
+            else:
                 self.canvas.yview_moveto(0)
-                self.root.title(f"PDF Viewer - Page {page_number + 1}/{len(self.pdf_document)}")
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to render page: {e}")
+        else:
+            self.canvas.xview_moveto(x_fraction)
+            self.canvas.yview_moveto(y_fraction)
 
-    def show_image(self, page_number):
-        if self.cbz_images and 0 <= page_number < len(self.cbz_images):
-            try:
-                img = self.cbz_images[page_number]
-                img = img.resize((int(img.width * self.zoom_level), int(img.height * self.zoom_level)), Image.LANCZOS)
+    def display_frame(self, img, reset_view=True, whole_page=True):
+        try:
+            with perf.stage('photoimage'):
                 self.photo = ImageTk.PhotoImage(img)
-                self.canvas.delete("all")
-
-                # Calculate centered coordinates
-                canvas_width = self.canvas.winfo_width()
-                canvas_height = self.canvas.winfo_height()
-                img_width, img_height = img.size
-
-                x = max((canvas_width - img_width) // 2, 0)
-                y = max((canvas_height - img_height) // 2, 0)
+            canvas_start = time.perf_counter()
+            self.canvas.delete("all")
+            self.tiled_view = None
+            self.tile_items = {}
+            self.continuous_layout = None
 
-                self.canvas.create_image(x, y, anchor=tk.NW, image=self.photo)
-
-                # Update scroll region and reset view to top
-                self.canvas.config(scrollregion=self.canvas.bbox(tk.ALL))
+            # Calculate centered coordinates
+            canvas_width = self.canvas.winfo_width()
+            canvas_height = self.canvas.winfo_height()
+            img_width, img_height = img.size
+
+            x = max((canvas_width - img_width) // 2, 0)
+            y = max((canvas_height - img_height) // 2, 0)
+
+            self.canvas.create_image(x, y, anchor=tk.NW, image=self.photo)
+            self.page_origins = []
+            if self.document and whole_page:
+                # Zoom previews are shown at the new size before their render, so the scale comes from the image
+                self.page_origins = self.view_origins(self.current_page, x, y, img_width / self.view_size(self.current_page)[0])
+                for origin in self.page_origins:
+                    self.draw_search_hits(*origin)
+
+            # Update scroll region and reset view to top
+            self.keep_view(lambda: self.canvas.config(scrollregion=self.canvas.bbox(tk.ALL)), reset_view and whole_page)
+            if not whole_page:
+                self.canvas.xview_moveto(0)
                 self.canvas.yview_moveto(0)
-                self.root.title(f"Comic Viewer - Page {page_number + 1}/{len(self.cbz_images)}")
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to render image: {e}")
+            perf.record('canvas', time.perf_counter() - canvas_start)
+            self.update_perf_overlay()
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to render page: {e}")
 
     def on_mouse_wheel(self, event):
         self.canvas.yview_scroll(-1 * int(event.delta / 120), "units")
@@ -335,62 +2739,101 @@ class PDFViewer:
             self.zoom_out()
 
     def prev_page(self):
-        if (self.pdf_document and self.current_page > 0) or (self.cbz_images and self.current_page > 0):
-            self.current_page -= 1
-            if self.pdf_document:
-                self.show_page(self.current_page)
-            elif self.cbz_images:
-                self.show_image(self.current_page)
+        if self.document and self.step_panel(-1):
+            return
+        previous = self.view_step(self.current_page, -1) if self.document else None
+        if previous is not None:
+            self.current_page = previous
+            self.show_page(self.current_page, panel=-1)
 
     def next_page(self):
-        if (self.pdf_document and self.current_page < len(self.pdf_document) - 1) or (self.cbz_images and self.current_page < len(self.cbz_images) - 1):
-            self.current_page += 1
-            if self.pdf_document:
-                self.show_page(self.current_page)
-            elif self.cbz_images:
-                self.show_image(self.current_page)
+        if self.document and self.step_panel(1):
+            return
+        following = self.view_step(self.current_page, 1) if self.document else None
+        if following is not None:
+            self.current_page = following
+            self.show_page(self.current_page)
+
+    def page_left(self):
+        # The arrows turn pages the way they turn on paper, backwards in left to right reading
+        if self.right_to_left:
+            self.next_page()
+        else:
+            self.prev_page()
+
+    def page_right(self):
+        if self.right_to_left:
+            self.prev_page()
+        else:
+            self.next_page()
 
     def zoom_in(self):
-        self.zoom_level *= 1.2
-        if self.pdf_document:
-            self.show_page(self.current_page)
-        elif self.cbz_images:
-            self.show_image(self.current_page)
+        self.fit_mode = None
+        self.zoom_level = clamp_zoom(self.zoom_level * 1.2)
+        self.schedule_zoom_render()
 
     def zoom_out(self):
-        self.zoom_level /= 1.2
-        if self.pdf_document:
-            self.show_page(self.current_page)
-        elif self.cbz_images:
-            self.show_image(self.current_page)
+        self.fit_mode = None
+        self.zoom_level = clamp_zoom(self.zoom_level / 1.2)
+        self.schedule_zoom_render()
+
+    def schedule_zoom_render(self):
+        # Bursts of zoom steps are shown by scaling the bitmap already on screen,
+        # the real render only happens once the input has settled
+        if not self.document:
+            return
+        self.shown_key = None  # Whatever is still rendering is for an outdated zoom level
+        self.render_pipeline.cancel(group='page')
+        if self.zoom_base and not self.tiled_view:
+            img, zoom = self.zoom_base
+            scale = self.zoom_level / zoom
+            width, height = max(int(img.width * scale), 1), max(int(img.height * scale), 1)
+            if width * height <= TILED_RENDER_PIXELS:
+                self.display_frame(img.resize((width, height), Image.NEAREST), reset_view=False)
+        if self.zoom_render_id is not None:
+            self.root.after_cancel(self.zoom_render_id)
+        self.zoom_render_id = self.root.after(ZOOM_SETTLE_MS, self.render_zoomed)
+
+    def render_zoomed(self):
+        self.zoom_render_id = None
+        self.show_page(self.current_page, reset_view=False)
 
     def fit_width(self):
-        if self.pdf_document:
-            page = self.pdf_document[self.current_page]
-            page_width = page.rect.width
-            canvas_width = self.canvas.winfo_width()
-            self.zoom_level = canvas_width / page_width
+        if self.document:
+            self.fit_mode = 'width'
+            self.apply_fit()
             self.show_page(self.current_page)
-        elif self.cbz_images:
-            img = self.cbz_images[self.current_page]
-            img_width, _ = img.size
-            canvas_width = self.canvas.winfo_width()
-            self.zoom_level = canvas_width / img_width
-            self.show_image(self.current_page)
 
     def fit_height(self):
-        if self.pdf_document:
-            page = self.pdf_document[self.current_page]
-            page_height = page.rect.height
-            canvas_height = self.canvas.winfo_height()
-            self.zoom_level = canvas_height / page_height
+        if self.document:
+            self.fit_mode = 'height'
+            self.apply_fit()
             self.show_page(self.current_page)
-        elif self.cbz_images:
-            img = self.cbz_images[self.current_page]
-            _, img_height = img.size
-            canvas_height = self.canvas.winfo_height()
-            self.zoom_level = canvas_height / img_height
-            self.show_image(self.current_page)
+
+    def apply_fit(self):
+        self.zoom_level = self.fit_zoom(self.current_page)
+
+    def fit_zoom(self, page_number):
+        page_width, page_height = self.view_size(page_number)
+        box = self.crop_box(page_number)
+        if box:
+            # Fit the content rather than the page
+            page_width *= box[2] - box[0]
+            page_height *= box[3] - box[1]
+        if self.fit_mode == 'width':
+            return clamp_zoom(self.canvas.winfo_width() / page_width)
+        return clamp_zoom(self.canvas.winfo_height() / page_height)
+
+    def on_canvas_configure(self, event):
+        # While fitting, window resizes zoom through the same coalescing path as the zoom buttons
+        if self.fit_mode and self.document:
+            old_zoom = self.zoom_level
+            self.apply_fit()
+            if quantize_zoom(old_zoom) != quantize_zoom(self.zoom_level):
+                self.schedule_zoom_render()
+        elif self.document and self.page_panels(self.current_page):
+            self.schedule_zoom_render()  # Panels are fitted to the canvas, and rendered for its size
+        self.schedule_viewport_update()
 
     def open_music(self):
         file_paths = filedialog.askopenfilenames(filetypes=[("Audio files", "*.mp3;*.wav")])
@@ -398,60 +2841,138 @@ class PDFViewer:
             self.music_files = list(file_paths)
             self.current_music_index = 0
             if self.music_files:
-                pygame.mixer.music.load(self.music_files[self.current_music_index])
-                self.song_label.config(text=os.path.basename(self.music_files[self.current_music_index]))
+                # Durations and titles are read in the background, the current track first
+                self.playlist_scanner.scan(self.music_files[:1], priority=0)
+                self.playlist_scanner.scan(self.music_files[1:])
+                self.poll_playlist_scan()
+                self.cancel_music_timers()
+                self.load_music(self.music_files[self.current_music_index])  # Loading stops whatever was playing
+                self.music_playing = self.music_paused = False
+                self.update_song_labels()
 
     def play_music(self):
         if self.music_files:
-            pygame.mixer.music.load(self.music_files[self.current_music_index])
-            pygame.mixer.music.play()
-            self.music_playing = True
-            self.music_length = self.get_music_length(self.music_files[self.current_music_index])
-            self.total_time_label.config(text=self.format_time(self.music_length))  # Update total time label
-            self.update_music_progress()
-
-    def get_music_length(self, file_path):
-        if file_path.lower().endswith('.mp3'):
-            audio = MP3(file_path)
-            return audio.info.length
-        else:
-            audio = pygame.mixer.Sound(file_path)
-            return audio.get_length()
+            if self.music_paused:
+                pygame.mixer.music.unpause()
+                self.music_playing = True
+                self.music_paused = False
+                self.schedule_track_end_check()
+                self.update_music_progress()
+            else:
+                self.start_track(self.current_music_index)
+
+    def start_track(self, index):
+        self.current_music_index = index
+        self.load_music(self.music_files[index])
+        pygame.mixer.music.play()
+        pygame.event.clear(pygame.USEREVENT)  # Stopping the previous track may have posted an end event
+        self.music_playing = True
+        self.music_paused = False
+        self.music_offset = (0.0, 0)
+        self.queue_next_track()
+        self.update_song_labels()
+        self.schedule_track_end_check()
+        self.update_music_progress()
+
+    def queue_next_track(self):
+        # The mixer decodes the queued track as soon as the current one ends, so there's no gap between them
+        next_path = self.music_files[(self.current_music_index + 1) % len(self.music_files)]
+        with perf.stage('music_queue', os.path.basename(next_path)):
+            pygame.mixer.music.queue(next_path)
+
+    def load_music(self, file_path):
+        load_audio()
+        with perf.stage('music_load', os.path.basename(file_path)):
+            pygame.mixer.music.load(file_path)
+
+    def update_song_labels(self):
+        # Shows what is known about the current track, the scanner fills in the rest as it gets there
+        file_path = self.music_files[self.current_music_index]
+        info = self.track_info.get(file_path) or {}
+        self.song_label.config(text=info.get('title') or os.path.basename(file_path))
+        self.music_length = info.get('length', 0)
+        self.total_time_label.config(text=self.format_time(self.music_length) if info else "--:--")  # Update total time label
+        if self.music_playing:
+            self.schedule_track_end_check()  # The expected end moved now that the length is known
+
+    def poll_playlist_scan(self):
+        self.playlist_poll_id = None
+        for file_path, info in self.playlist_scanner.results():
+            self.track_info[file_path] = info or {'length': 0, 'title': None}
+            if self.music_files and file_path == self.music_files[self.current_music_index]:
+                self.update_song_labels()
+        if self.playlist_scanner.pending:
+            self.playlist_poll_id = self.root.after(PLAYLIST_POLL_MS, self.poll_playlist_scan)
 
     def pause_music(self):
         if self.music_playing:
             pygame.mixer.music.pause()
             self.music_playing = False
+            self.music_paused = True
+            self.cancel_music_timers()
 
     def next_music(self):
         if self.music_files:
             pygame.mixer.music.stop()
-            self.current_music_index = (self.current_music_index + 1) % len(self.music_files)
-            pygame.mixer.music.load(self.music_files[self.current_music_index])
-            pygame.mixer.music.play()
-            self.music_playing = True
-            self.song_label.config(text=os.path.basename(self.music_files[self.current_music_index]))
+            self.start_track((self.current_music_index + 1) % len(self.music_files))
 
     def shuffle_music(self):
         if self.music_files:
             import random
             random.shuffle(self.music_files)
-            self.current_music_index = 0
-            pygame.mixer.music.load(self.music_files[self.current_music_index])
-            self.song_label.config(text=os.path.basename(self.music_files[self.current_music_index]))
+            if self.music_playing or self.music_paused:
+                self.start_track(0)
+            else:
+                self.current_music_index = 0
+                self.load_music(self.music_files[self.current_music_index])
+                self.update_song_labels()
+
+    def cancel_music_timers(self):
+        for attribute in ('track_end_id', 'music_progress_id'):
+            after_id = getattr(self, attribute)
+            if after_id is not None:
+                self.root.after_cancel(after_id)
+                setattr(self, attribute, None)
+
+    def music_position(self):
+        position, started_at = self.music_offset
+        return position + max(pygame.mixer.music.get_pos() - started_at, 0) / 1000
+
+    def schedule_track_end_check(self):
+        # One wakeup just after the track should end, instead of polling the mixer for it
+        if self.track_end_id is not None:
+            self.root.after_cancel(self.track_end_id)
+        if self.music_length:
+            delay = max((self.music_length - self.music_position()) * 1000, 0) + TRACK_END_SLACK_MS
+        else:
+            delay = TRACK_END_CHECK_MS
+        self.track_end_id = self.root.after(int(delay), self.check_track_end)
+
+    def check_track_end(self):
+        self.track_end_id = None
+        if pygame.event.get(pygame.USEREVENT):
+            # The queued track is already playing, catch up with it and queue the one after
+            self.current_music_index = (self.current_music_index + 1) % len(self.music_files)
+            self.music_offset = (0.0, 0)  # get_pos() restarts with the queued track
+            self.queue_next_track()
+            self.update_song_labels()
+        if self.music_playing:
+            self.schedule_track_end_check()
 
     def update_music_progress(self):
-        if self.music_playing and not self.dragging:
-            current_pos = pygame.mixer.music.get_pos() / 1000  # Convert to seconds
+        if self.music_progress_id is not None:
+            self.root.after_cancel(self.music_progress_id)
+            self.music_progress_id = None
+        if not self.music_playing or self.comic_mode:
+            return  # Nothing to show, play and leaving Quiet Mode start the updates again
+        if not self.dragging:
+            current_pos = min(self.music_position(), self.music_length or float('inf'))
             progress = (current_pos / self.music_length) * 100 if self.music_length > 0 else 0
             self.progress_bar.set(progress)
             self.current_time_label.config(text=self.format_time(current_pos))  # Update current time label
-            if current_pos < self.music_length:
-                self.root.after(100, self.update_music_progress)  # Check every 100 milliseconds
-            else:
-                self.music_playing = False
-                self.progress_bar.set(0)  # Reset progress bar when music ends
-                self.current_time_label.config(text="00:00")  # Reset current time label
+        # Update about as often as the bar moves by a pixel, within the limits
+        interval = min(max(self.music_length * 1000 / PROGRESS_STEPS, PROGRESS_MIN_MS), PROGRESS_MAX_MS)
+        self.music_progress_id = self.root.after(int(interval), self.update_music_progress)
 
     def format_time(self, seconds):
         minutes = int(seconds // 60)
@@ -468,29 +2989,142 @@ class PDFViewer:
     def set_music_position(self, event):
         if self.music_length > 0:
             new_position = self.progress_bar.get() / 100 * self.music_length  # Calculate new position in seconds
-            pygame.mixer.music.set_pos(new_position)  # Set new position
+            try:
+                pygame.mixer.music.set_pos(new_position)  # Set new position
+            except pygame.error:
+                return  # The format doesn't support seeking
+            self.music_offset = (new_position, pygame.mixer.music.get_pos())
+            if self.music_playing:
+                self.schedule_track_end_check()
             self.current_time_label.config(text=self.format_time(new_position))  # Update current time label
 
+    def search(self, event=None):
+        query = self.search_entry.get().strip()
+        self.search_query = query or None
+        self.search_pages = []
+        self.search_rects = {}
+        self.render_pipeline.cancel(group='search')
+        self.refresh_search_hits()
+        if not isinstance(self.document, PDFPageSource):
+            self.search_label.config(text="No text to search" if query and self.document else "")
+            return
+        if query:
+            self.search_index.search(self.document, query)
+            self.poll_search_index()
+        self.update_search_label()
+
+    def poll_search_index(self):
+        # Collects indexing progress and streamed matches, while the indexer has anything left to do
+        if self.search_poll_id is not None:
+            self.root.after_cancel(self.search_poll_id)
+            self.search_poll_id = None
+        for document, kind, payload in self.search_index.results():
+            if document is not self.document:
+                continue  # From a document that has since been closed
+            if kind == 'progress':
+                self.index_progress = payload
+            else:
+                query, pages = payload
+                if query != self.search_query or not pages:
+                    continue
+                first_hits = not self.search_pages
+                for page in pages:
+                    bisect.insort(self.search_pages, page)
+                if first_hits and self.current_page not in self.search_pages:
+                    self.next_search_hit()  # Go to the first match after the current page
+                else:
+                    self.refresh_search_hits()
+        self.update_search_label()
+        if self.search_index.busy:
+            self.search_poll_id = self.root.after(SEARCH_POLL_MS, self.poll_search_index)
+
+    def update_search_label(self):
+        if self.search_index.error:
+            self.search_label.config(text=self.search_index.error)
+            return
+        parts = []
+        if self.search_query:
+            count = len(self.search_pages)
+            parts.append(f"{count} page{'s' if count != 1 else ''}")
+        if self.index_progress and self.index_progress[0] < self.index_progress[1]:
+            parts.append(f"indexing {self.index_progress[0]}/{self.index_progress[1]}")
+        self.search_label.config(text=", ".join(parts))
+
+    def next_search_hit(self, event=None):
+        if self.search_pages:
+            index = bisect.bisect_right(self.search_pages, self.view_pages(self.current_page)[-1])  # Past the spread on screen
+            self.current_page = self.search_pages[index % len(self.search_pages)]
+            self.show_page(self.current_page)
+
+    def prev_search_hit(self, event=None):
+        if self.search_pages:
+            index = bisect.bisect_left(self.search_pages, self.current_page)
+            self.current_page = self.search_pages[index - 1]
+            self.show_page(self.current_page)
+
+    def draw_search_hits(self, page, x, y, zoom):
+        # Outlines the matches on a page drawn at (x, y) on the canvas
+        if not self.search_query or not self.search_pages or page not in self.search_pages:
+            return
+        rects = self.search_rects.get(page)
+        if rects is None:
+            self.request_search_hits(page)
+            return
+        for x0, y0, x1, y1 in rects:
+            self.canvas.create_rectangle(x + x0 * zoom, y + y0 * zoom, x + x1 * zoom, y + y1 * zoom,
+                                         outline='#ffcc00', width=2, tags=("search_hit", f"search_hit_{page}"))
+
+    def request_search_hits(self, page):
+        # MuPDF's text search takes the document lock and can run long on dense pages, so it is done by the
+        # render workers and the outlines drawn once the boxes come back
+        document, query = self.document, self.search_query
+        key = ('search_hits', document.identity, page, query)
+
+        def find():
+            with perf.stage('search_hits', f"page {page + 1}"):
+                return document.search_page(page, query.split())
+        self.render_pipeline.submit(key, find, self.on_search_hits, priority=1, group='search')
+        self.schedule_render_drain()
+
+    def on_search_hits(self, key, result, error):
+        _, identity, page, query = key
+        if not self.document or identity != self.document.identity or query != self.search_query:
+            return
+        self.search_rects[page] = result if error is None else []
+        self.refresh_search_hits()
+
+    def refresh_search_hits(self):
+        self.canvas.delete("search_hit")
+        if self.continuous and self.continuous_layout:
+            layout = self.continuous_layout
+            for page in self.continuous_items:
+                self.draw_search_hits(page, layout['lefts'][page], layout['tops'][page], layout['zoom'])
+        else:
+            for origin in self.page_origins:
+                self.draw_search_hits(*origin)
+        self.canvas.tag_raise("search_hit")
+
     def jump_to_page(self):
         try:
             page_number = int(self.page_entry.get()) - 1
-            if self.pdf_document and 0 <= page_number < len(self.pdf_document):
+            if self.document and 0 <= page_number < len(self.document):
                 self.current_page = page_number
                 self.show_page(self.current_page)
-            elif self.cbz_images and 0 <= page_number < len(self.cbz_images):
-                self.current_page = page_number
-                self.show_image(self.current_page)
         except ValueError:
             messagebox.showerror("Error", "Invalid page number")
 
     # Keyboard input methods
-    def next_page_key(self, event):
-        self.next_page()
+    def page_right_key(self, event):
+        if not isinstance(event.widget, tk.Entry):  # Arrow keys move the cursor while typing
+            self.page_right()
 
-    def prev_page_key(self, event):
-        self.prev_page()
+    def page_left_key(self, event):
+        if not isinstance(event.widget, tk.Entry):
+            self.page_left()
 
     def toggle_play_pause_music(self, event):
+        if isinstance(event.widget, tk.Entry):
+            return  # A space typed into the page number or search box
         if self.music_playing:
             self.pause_music()
         else:
@@ -500,7 +3134,18 @@ class PDFViewer:
         self.next_music()
 
 if __name__ == "__main__":
+    import multiprocessing
+    multiprocessing.freeze_support()  # PDF render processes start the bundled executable again
+    if len(sys.argv) > 1 and sys.argv[1] == '--export':
+        sys.exit(export_main(sys.argv[2:]))
+    # A viewer that is already running opens the file instead, which skips a whole cold start
+    if len(sys.argv) > 1 and send_to_running_instance(sys.argv[1]):
+        sys.exit(0)
     root = tk.Tk()
     viewer = PDFViewer(root)
+    try:
+        instance_server = InstanceServer(root, viewer.open_path)
+    except OSError as e:
+        print(f"Error starting single instance listener: {e}")
     root.state('zoomed')  # Open the window maximized
     root.mainloop()